@@ -0,0 +1,117 @@
+"""
+Bakes the game's images into a single bundle file, so startup doesn't
+have to decode and scale PNGs one at a time:
+
+    python bake.py
+
+Sprites are prescaled and packed into one RGBA texture atlas. Large
+opaque images (the backgrounds) are stored separately as RGB. The
+bundle is loaded at startup by ``main.load_bundle``, and is ignored if
+any of the assets it was baked from change.
+"""
+import argparse
+import json
+import os
+
+import pygame
+
+import main
+
+BACKGROUNDS = [
+    'assets/art/spacefield1600x1000.png',
+]
+ATLAS_WIDTH = 1024
+PADDING = 1
+
+
+def sprite_images():
+    """
+    Returns ``(key, source path, surface)`` for every sprite image the
+    game loads, scaled the same way the game scales them.
+    """
+    images = []
+    for path in (main.Player.img, main.Laser.image_file, main.LaserHit.image_file):
+        images.append((path, path, main.load_image(path)))
+    for path in main.EnemyFactory.image_files.values():
+        size = main.EnemyFactory.scale
+        images.append((main.scaled_image_key(path, size), path, main.load_scaled_image(path, size)))
+    for path in main.BiggerEnemyFactory.image_files.values():
+        images.append((path, path, main.load_image(path)))
+    # The same file can be used by more than one sprite
+    unique = {}
+    for key, path, image in images:
+        unique[key] = (key, path, image)
+    return list(unique.values())
+
+
+def pack(images):
+    """
+    Simple shelf packing, tallest images first. Returns the atlas size,
+    and the rect for each image key.
+    """
+    rects = {}
+    x = y = shelf_height = 0
+    for key, path, image in sorted(images, key=lambda item: -item[2].get_height()):
+        width, height = image.get_size()
+        if x + width > ATLAS_WIDTH:
+            x = 0
+            y += shelf_height + PADDING
+            shelf_height = 0
+        rects[key] = (x, y, width, height)
+        x += width + PADDING
+        shelf_height = max(shelf_height, height)
+    return (ATLAS_WIDTH, y + shelf_height), rects
+
+
+def bake(path=main.BUNDLE_PATH):
+    images = sprite_images()
+    atlas_size, rects = pack(images)
+    atlas = pygame.Surface(atlas_size, pygame.SRCALPHA, 32)
+    atlas.fill((0, 0, 0, 0))
+    for key, source, image in images:
+        # BLEND_RGBA_MAX onto a transparent atlas copies pixels exactly,
+        # rather than alpha blending them.
+        atlas.blit(image, rects[key][:2], special_flags=pygame.BLEND_RGBA_MAX)
+
+    blobs = [(atlas, 'RGBA', {key: rect for key, rect in rects.items()})]
+    for background in BACKGROUNDS:
+        blobs.append((main.load_image(background), 'RGB', {background: None}))
+
+    header = {'sources': sorted({source for key, source, image in images} | set(BACKGROUNDS)), 'blobs': []}
+    body = []
+    offset = 0
+    for surface, pixel_format, keys in blobs:
+        pixels = pygame.image.tobytes(surface, pixel_format)
+        header['blobs'].append({
+            'size': surface.get_size(),
+            'format': pixel_format,
+            'offset': offset,
+            'length': len(pixels),
+            'images': keys,
+        })
+        body.append(pixels)
+        offset += len(pixels)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    local_path = os.path.join(*path.split("/"))
+    with open(local_path, 'wb') as bundle_file:
+        bundle_file.write(main.BUNDLE_HEADER.pack(main.BUNDLE_MAGIC, len(header_bytes)))
+        bundle_file.write(header_bytes)
+        for pixels in body:
+            bundle_file.write(pixels)
+    print('Baked {} sprites ({}x{} atlas) and {} backgrounds into {} ({:,} bytes)'.format(
+        len(rects), atlas_size[0], atlas_size[1], len(BACKGROUNDS), path, os.path.getsize(local_path)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Bake AstroSky assets into a bundle')
+    parser.add_argument('--output', default=main.BUNDLE_PATH)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.init()
+    pygame.display.set_mode((main.SCREEN_WIDTH, main.SCREEN_HEIGHT))
+    bake(args.output)
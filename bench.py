@@ -0,0 +1,329 @@
+"""
+Benchmarks for AstroSky's hot paths. Runs without a display or sound
+device, e.g.:
+
+    python bench.py collisions --enemies 200 --lasers 5000
+    python bench.py projectiles --lasers 5000
+    python bench.py suite --json baseline.json
+    python bench.py suite --baseline baseline.json
+
+``suite`` runs microbenchmarks of the per-frame hot paths, and stress
+scenarios played through whole frames, and reports per-call times in
+milliseconds. With ``--baseline``, each result's median is compared
+with a run saved by ``--json``, and the exit status is 1 if anything
+got slower than ``--tolerance`` allows.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+from random import Random
+from time import perf_counter
+
+import pygame
+
+import main
+
+
+class Box(pygame.sprite.Sprite):
+    def __init__(self, rect, *groups):
+        super().__init__(*groups)
+        self.rect = rect
+
+
+def make_groups(enemies, lasers, seed=0):
+    """
+    Scatters enemy and laser sized rects across the screen.
+    """
+    rng = Random(seed)
+    enemy_group = pygame.sprite.Group()
+    laser_group = pygame.sprite.Group()
+    for _ in range(enemies):
+        position = (rng.randrange(0, main.SCREEN_WIDTH - 82), rng.randrange(-100, main.SCREEN_HEIGHT))
+        Box(pygame.rect.Rect(position, (82, 67)), enemy_group)
+    for _ in range(lasers):
+        position = (rng.randrange(0, main.SCREEN_WIDTH - 9), rng.randrange(0, main.SCREEN_HEIGHT))
+        Box(pygame.rect.Rect(position, (9, 37)), laser_group)
+    return enemy_group, laser_group
+
+
+def time_it(func, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (perf_counter() - start) / repeat, result
+
+
+def bench_collisions(enemies, lasers, repeat):
+    """
+    Compares ``pygame.sprite.groupcollide`` with ``sweep_groupcollide``
+    on the same sprites, and checks that they agree.
+    """
+    enemy_group, laser_group = make_groups(enemies, lasers)
+    brute_time, expected = time_it(
+        lambda: pygame.sprite.groupcollide(enemy_group, laser_group, False, False), repeat)
+    sweep_time, result = time_it(
+        lambda: main.sweep_groupcollide(enemy_group, laser_group, False, False), repeat)
+    assert result == expected, 'sweep_groupcollide disagrees with groupcollide'
+    print('{} enemies x {} lasers, {} colliding enemies'.format(enemies, lasers, len(result)))
+    print('  groupcollide          {:8.3f}ms'.format(brute_time * 1000))
+    print('  sweep_groupcollide    {:8.3f}ms  ({:.1f}x)'.format(sweep_time * 1000, brute_time / sweep_time))
+
+
+def bench_projectiles(enemies, lasers, repeat):
+    """
+    Times a full frame of lasers (update, collide with enemies, draw) as
+    ``Laser`` sprites and as a ``ProjectileSystem``.
+    """
+    screen = pygame.display.get_surface()
+    enemy_group, boxes = make_groups(enemies, lasers)
+    positions = [box.rect.midbottom for box in boxes]
+    image = main.load_image(main.Laser.image_file)
+
+    def sprite_frame():
+        # Respawn what was culled or hit, so every frame has the same load
+        lasers = pygame.sprite.Group(main.Laser(position) for position in positions)
+        start = perf_counter()
+        lasers.update(1 / main.FPS)
+        main.sweep_groupcollide(enemy_group, lasers, False, True)
+        lasers.draw(screen)
+        return perf_counter() - start
+
+    def array_frame():
+        projectiles = main.ProjectileSystem(image)
+        for position in positions:
+            projectiles.add(position)
+        start = perf_counter()
+        projectiles.update(1 / main.FPS)
+        projectiles.collide(enemy_group)
+        projectiles.draw(screen)
+        return perf_counter() - start
+
+    sprite_time = sum(sprite_frame() for _ in range(repeat)) / repeat
+    array_time = sum(array_frame() for _ in range(repeat)) / repeat
+    print('{} lasers, {} enemies, per frame'.format(lasers, enemies))
+    print('  Laser sprites         {:8.3f}ms'.format(sprite_time * 1000))
+    print('  ProjectileSystem      {:8.3f}ms  ({:.1f}x)'.format(array_time * 1000, sprite_time / array_time))
+
+
+def time_calls(func, repeat, setup=None):
+    """
+    Calls ``func`` ``repeat`` times, running ``setup`` untimed before
+    each call, and returns the ``FrameTimeStats`` of the calls.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return main.frame_time_stats(times)
+
+
+def start_game(seed=0, warmup=600):
+    """
+    Starts a bot played game, and plays ``warmup`` frames so there are
+    enemies, lasers and effects on screen.
+    """
+    bot = main.BotInput(seed=seed)
+    game = main.Game(controls=bot, seed=seed, preload=False)
+    bot.game = game
+    game.start()
+    for _ in range(warmup):
+        game.update(1 / main.FPS, [])
+    return game
+
+
+def micro_benchmarks(repeat):
+    screen = pygame.display.get_surface()
+    dt = 1 / main.FPS
+    game = start_game()
+    level = game.level
+    results = {}
+    results['Level.update'] = time_calls(lambda: level.update(dt, []), repeat)
+    results['Level.draw'] = time_calls(lambda: level.draw(screen), repeat)
+    results['Background.draw'] = time_calls(lambda: level.background.draw(screen), repeat)
+    results['Starfield.update'] = time_calls(lambda: level.background.starfield.update(dt), repeat)
+
+    enemies, lasers = make_groups(100, 1000)
+    results['sweep_groupcollide'] = time_calls(
+        lambda: main.sweep_groupcollide(enemies, lasers, False, False), repeat)
+
+    # Keep an ability cooling down, so the panel has a bar to redraw
+    player = level.player
+
+    def cool_down():
+        player.burst_cooldown_state = (player.burst_cooldown_state - dt) % player.burst_cooldown
+
+    results['Level.display_cooldowns'] = time_calls(lambda: level.display_cooldowns(screen), repeat, cool_down)
+    game.stop()
+    return results
+
+
+def play_frames(level, frames, setup=None):
+    """
+    Times whole frames (update and draw) of a level.
+    """
+    screen = pygame.display.get_surface()
+
+    def frame():
+        level.update(1 / main.FPS, [])
+        level.draw(screen)
+
+    return time_calls(frame, frames, setup)
+
+
+def scripted_level(script, seed=0):
+    main.rng.seed(seed)
+    levels = main.Game(controls=main.ScriptedInput(script), preload=False).load_levels()
+    level = next(levels)
+    level.start()
+    return level
+
+
+def scenario_enemies(frames, count=1000):
+    """
+    A screen packed with ``count`` slow enemies, topped up every frame,
+    while the player fires.
+    """
+    level = scripted_level(lambda frame: [pygame.K_LSHIFT])
+    rng = Random(0)
+
+    def top_up():
+        while len(level.enemies) < count:
+            position = (rng.randrange(0, main.SCREEN_WIDTH - 82), rng.randrange(0, main.SCREEN_HEIGHT - 300))
+            level.enemy_factory.spawn(position, level.enemies, dy=5)
+
+    results = play_frames(level, frames, top_up)
+    level.close()
+    return results
+
+
+def scenario_rapid_fire(frames):
+    """
+    A level 10 player sweeping side to side with every weapon firing.
+    """
+    level = scripted_level(lambda frame: [pygame.K_LSHIFT, pygame.K_q,
+                                          pygame.K_LEFT if frame % 120 < 60 else pygame.K_RIGHT])
+    while level.player.level < level.player.max_level:
+        level.player.powerup()
+    results = play_frames(level, frames)
+    level.close()
+    return results
+
+
+def scenario_long_session(frames, level_frames=500):
+    """
+    A bot played game, with each level ended after ``level_frames``.
+    Plays at least ``frames`` frames, and carries on until every level
+    config has been played and handed off, including a repeat of the
+    last one, so every handoff path is timed.
+    """
+    game = start_game(warmup=0)
+    screen = pygame.display.get_surface()
+    times = []
+    while len(times) < frames or game.level_number <= len(game.level_configs):
+        if (len(times) + 1) % level_frames == 0 and not game.level.is_complete:
+            game.level.score = game.level.end_score
+        start = perf_counter()
+        game.update(1 / main.FPS, [])
+        game.level.draw(screen)
+        times.append(perf_counter() - start)
+    game.stop()
+    return main.frame_time_stats(times)
+
+
+def run_suite(repeat, frames):
+    results = micro_benchmarks(repeat)
+    results['scenario.enemies_1000'] = scenario_enemies(frames)
+    results['scenario.rapid_fire_level_10'] = scenario_rapid_fire(frames)
+    results['scenario.long_session'] = scenario_long_session(frames * 10)
+    return {
+        name: {
+            'calls': stats.frames,
+            'mean': stats.mean * 1000,
+            'p50': stats.p50 * 1000,
+            'p95': stats.p95 * 1000,
+            'max': stats.max * 1000,
+        }
+        for name, stats in results.items()
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each result against the baseline's median, and returns the
+    names of the ones that are slower than ``tolerance`` allows.
+    """
+    regressions = []
+    print('{:<30} {:>9} {:>9} {:>9} {:>8}'.format('Benchmark (ms)', 'p50', 'p95', 'baseline', 'change'))
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print('{:<30} {:9.3f} {:9.3f} {:>9} {:>8}'.format(name, result['p50'], result['p95'], '-', 'new'))
+            continue
+        change = result['p50'] / previous['p50'] - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif change < -tolerance:
+            flag = '  faster'
+        print('{:<30} {:9.3f} {:9.3f} {:9.3f} {:+7.0%}{}'.format(
+            name, result['p50'], result['p95'], previous['p50'], change, flag))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='AstroSky benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    collisions = subparsers.add_parser('collisions', help='Enemy vs. laser collision stress test')
+    collisions.add_argument('--enemies', type=int, default=200)
+    collisions.add_argument('--lasers', type=int, default=5000)
+    collisions.add_argument('--repeat', type=int, default=20)
+    projectiles = subparsers.add_parser('projectiles', help='Laser sprites vs. the array projectile system')
+    projectiles.add_argument('--enemies', type=int, default=50)
+    projectiles.add_argument('--lasers', type=int, default=5000)
+    projectiles.add_argument('--repeat', type=int, default=20)
+    suite = subparsers.add_parser('suite', help='Microbenchmarks and stress scenarios, with baselines')
+    suite.add_argument('--repeat', type=int, default=500, help='Calls per microbenchmark')
+    suite.add_argument('--frames', type=int, default=300, help='Frames per scenario')
+    suite.add_argument('--json', default=None, metavar='PATH',
+                       help='Write results to PATH, for use as a --baseline later')
+    suite.add_argument('--baseline', default=None, metavar='PATH', help='Compare with results saved in PATH')
+    suite.add_argument('--tolerance', type=float, default=0.15,
+                       help='Fraction a median may slow down by before it counts as a regression')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main.init_headless()
+    if args.benchmark == 'collisions':
+        bench_collisions(args.enemies, args.lasers, args.repeat)
+    elif args.benchmark == 'projectiles':
+        bench_projectiles(args.enemies, args.lasers, args.repeat)
+    elif args.benchmark == 'suite':
+        # Include the cost of playing sounds, with nothing to play them on
+        os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+        main.init_audio()
+        main.preload_sounds()
+        output = {
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'numpy': main.numpy.__version__ if main.numpy is not None else None,
+            'results': run_suite(args.repeat, args.frames),
+        }
+        baseline = {}
+        if args.baseline:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)['results']
+        regressions = compare(output['results'], baseline, args.tolerance)
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(output, json_file, indent=2)
+        if regressions:
+            print('{} regression(s): {}'.format(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
@@ -1,107 +1,1390 @@
+from time import perf_counter
+# Taken before anything else is imported, for the startup timeline
+_import_started = perf_counter()
+
+import argparse
+import csv
+import json
 import os
-from collections import namedtuple
-from random import randrange, choice
-from math import copysign
+import struct
+import threading
+import weakref
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from random import Random
+from math import ceil, copysign
 import pygame
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 SCREEN_HEIGHT = 960
 SCREEN_WIDTH = 640
 SCREEN_RECT = pygame.rect.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
 FPS = 60
 
+# Gameplay randomness comes from a single generator, so that a seeded
+# game always plays out the same way.
+rng = Random()
+randrange = rng.randrange
+choice = rng.choice
+
+# Purely cosmetic randomness (e.g. hit effects) comes from its own
+# generator, so that drawing fewer effects can't change the gameplay.
+effect_rng = Random()
+
+
+ImageCacheInfo = namedtuple('ImageCacheInfo', ['hits', 'misses', 'evictions', 'size', 'bytes', 'budget'])
+
+
+def surface_bytes(surface):
+    """
+    Pixel memory owned by a surface. Subsurfaces share their parent's
+    pixels, so they don't own any.
+    """
+    if surface.get_parent() is not None:
+        return 0
+    return surface.get_pitch() * surface.get_height()
+
+
+class ImageCache(object):
+    """
+    LRU cache of decoded images, holding at most ``budget`` bytes of
+    pixels. Once over budget, the least recently used images are
+    dropped (sprites still using one keep it alive, but the cache lets
+    go). Pinned images, like a bundle's sprite atlas, are never evicted.
+
+    Levels are built on ``LevelLoader``'s worker thread, so every method
+    holds ``lock``.
+    """
+
+    def __init__(self, budget=64 * 1024 * 1024):
+        self.lock = threading.RLock()
+        self.budget = budget
+        self.surfaces = OrderedDict()
+        self.sizes = {}
+        self.pinned = set()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.surfaces
+
+    def get(self, key):
+        with self.lock:
+            surface = self.surfaces.get(key)
+            if surface is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+    def put(self, key, surface, pinned=False):
+        with self.lock:
+            self.discard(key)
+            self.surfaces[key] = surface
+            self.sizes[key] = surface_bytes(surface)
+            self.bytes += self.sizes[key]
+            if pinned:
+                self.pinned.add(key)
+            self._evict(keep=key)
+            return surface
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.surfaces:
+                del self.surfaces[key]
+                self.bytes -= self.sizes.pop(key)
+                self.pinned.discard(key)
+
+    def _evict(self, keep):
+        for key in list(self.surfaces):
+            if self.bytes <= self.budget:
+                break
+            if key == keep or key in self.pinned:
+                continue
+            self.discard(key)
+            self.evictions += 1
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict(keep=None)
+
+    def info(self):
+        with self.lock:
+            return ImageCacheInfo(self.hits, self.misses, self.evictions, len(self.surfaces),
+                                  self.bytes, self.budget)
+
+
+image_cache = ImageCache()
+
+
+def load_image(path, writable=False):
+    """
+    Returns the shared image at ``path``. Shared images are read only:
+    anything that draws onto its image must ask for a ``writable``
+    copy of its own.
+    """
+    image = image_cache.get(path)
+    if image is None:
+        local_path = os.path.join(*path.split("/"))
+        image = image_cache.put(path, pygame.image.load(local_path).convert_alpha())
+    return image.copy() if writable else image
+
+
+def scaled_image_key(path, size):
+    return '{}@{}x{}'.format(path, *size)
+
+
+def load_scaled_image(path, size, writable=False):
+    """
+    Returns the image at ``path`` scaled to ``size``. Scaled images are
+    cached (and can be prebaked) like any other image.
+    """
+    key = scaled_image_key(path, size)
+    image = image_cache.get(key)
+    if image is None:
+        image = image_cache.put(key, pygame.transform.scale(load_image(path), size))
+    return image.copy() if writable else image
+
+
+def load_opaque_image(path):
+    """
+    Returns the shared image at ``path`` without per-pixel alpha, for
+    images that always cover what's behind them, which blit faster
+    that way.
+    """
+    key = '{}@opaque'.format(path)
+    image = image_cache.get(key)
+    if image is None:
+        image = image_cache.get(path)
+        if image is not None and not image.get_flags() & pygame.SRCALPHA:
+            # Already opaque (e.g. loaded from the bundle)
+            return image
+        # Converted straight from the file, so the full size image isn't
+        # cached twice
+        local_path = os.path.join(*path.split("/"))
+        image = image_cache.put(key, pygame.image.load(local_path).convert())
+    return image
+
+
+_font_cache = {}
+
+
+def load_font(path, size):
+    """
+    Returns the shared ``Font`` for the given path and size, so levels
+    don't reload the same fonts every time they're built.
+    """
+    key = (path, size)
+    if key not in _font_cache:
+        _font_cache[key] = pygame.font.Font(os.path.join(*path.split("/")), size)
+    return _font_cache[key]
+
+
+BUNDLE_PATH = 'assets/bundle.bin'
+BUNDLE_MAGIC = b'ASKB'
+BUNDLE_HEADER = struct.Struct('<4sI')
+
+
+def load_bundle(path=BUNDLE_PATH):
+    """
+    Fills the image cache from an asset bundle written by ``bake.py``.
+
+    The bundle is read in one go, and each blob of raw pixels (the
+    sprite atlas, and any large images kept separate) becomes a surface
+    with ``pygame.image.frombuffer``, which is converted to the display
+    format once. Sprites are subsurfaces of the atlas.
+
+    Returns False, leaving the cache alone, if there's no bundle or
+    it's older than any of the assets it was baked from.
+    """
+    local_path = os.path.join(*path.split("/"))
+    if not os.path.exists(local_path):
+        return False
+    with open(local_path, 'rb') as bundle_file:
+        data = bundle_file.read()
+    magic, header_size = BUNDLE_HEADER.unpack_from(data)
+    if magic != BUNDLE_MAGIC:
+        return False
+    header = json.loads(data[BUNDLE_HEADER.size:BUNDLE_HEADER.size + header_size].decode('utf-8'))
+    bundle_mtime = os.path.getmtime(local_path)
+    for source in header['sources']:
+        if os.path.getmtime(os.path.join(*source.split("/"))) > bundle_mtime:
+            return False
+
+    body = BUNDLE_HEADER.size + header_size
+    for index, blob in enumerate(header['blobs']):
+        start = body + blob['offset']
+        pixels = data[start:start + blob['length']]
+        surface = pygame.image.frombuffer(pixels, blob['size'], blob['format'])
+        if blob['format'] == 'RGBA':
+            surface = surface.convert_alpha()
+        else:
+            surface = surface.convert()
+        if any(rect is not None for rect in blob['images'].values()):
+            # Sprites are subsurfaces, which keep the atlas alive, so the
+            # atlas is counted against the budget but never evicted.
+            image_cache.put('{}#{}'.format(path, index), surface, pinned=True)
+        for key, rect in blob['images'].items():
+            if rect is None:
+                image_cache.put(key, surface)
+            else:
+                image_cache.put(key, surface.subsurface(rect))
+    return True
+
+
+class NullSound(object):
+    """
+    Stands in for ``pygame.mixer.Sound`` when there is no audio device.
+    """
+    volume = 1.0
+
+    def play(self, *args, **kwargs):
+        return None
+
+    def stop(self):
+        pass
+
+    def fadeout(self, ms):
+        pass
+
+    def set_volume(self, value):
+        self.volume = min(max(value, 0.0), 1.0)
 
-_image_cache = {}
+    def get_volume(self):
+        return self.volume
 
 
-def load_image(path):
-    if path not in _image_cache:
+SOUND_FILES = (
+    'assets/sound/burst.wav',
+    'assets/sound/collide_1.wav',
+    'assets/sound/explosion_1.wav',
+    'assets/sound/laser_1.wav',
+    'assets/sound/laser_3.wav',
+    'assets/sound/powerup_1.wav',
+)
+
+SoundSettings = namedtuple('SoundSettings', ['category', 'limit', 'priority'])
+
+# Mixer channels reserved for each category of sound effect. Music is
+# streamed separately, and doesn't use a channel.
+SOUND_CATEGORIES = {
+    'weapons': 3,
+    'impacts': 4,
+    'cues': 2,
+}
+
+# How many copies of each sound may play at once, and how important it
+# is when channels run out (higher wins).
+SOUND_SETTINGS = {
+    'assets/sound/laser_1.wav': SoundSettings('weapons', 2, 1),
+    'assets/sound/laser_3.wav': SoundSettings('weapons', 1, 2),
+    'assets/sound/explosion_1.wav': SoundSettings('impacts', 3, 1),
+    'assets/sound/collide_1.wav': SoundSettings('impacts', 1, 2),
+    'assets/sound/burst.wav': SoundSettings('cues', 1, 2),
+    'assets/sound/powerup_1.wav': SoundSettings('cues', 1, 3),
+}
+DEFAULT_SOUND_SETTINGS = SoundSettings('impacts', 2, 1)
+
+ChannelInfo = namedtuple('ChannelInfo', ['played', 'steals', 'dropped'])
+
+
+class ChannelManager(object):
+    """
+    Plays sound effects on channels reserved for their category, so a
+    storm of explosions can't cut off weapon fire or a powerup cue.
+
+    Each sound is limited to ``SoundSettings.limit`` copies at once;
+    playing another restarts the oldest copy. If all of a category's
+    channels are busy, the lowest priority (then oldest) voice is
+    stolen, and if every voice outranks the new sound it's dropped.
+    """
+
+    def __init__(self, categories=SOUND_CATEGORIES):
+        self.categories = categories
+        self.channels = None
+        # Channel -> (sound, priority, order started)
+        self.voices = {}
+        self.started = 0
+        self.played = self.steals = self.dropped = 0
+        self.buffer = None
+
+    def _allocate(self):
+        total = sum(self.categories.values())
+        pygame.mixer.set_num_channels(total)
+        # Reserve every channel, so a plain Sound.play() can't take one
+        pygame.mixer.set_reserved(total)
+        self.channels = {}
+        index = 0
+        for category, count in self.categories.items():
+            self.channels[category] = [pygame.mixer.Channel(i) for i in range(index, index + count)]
+            index += count
+
+    def play(self, sound, settings=DEFAULT_SOUND_SETTINGS):
+        """
+        Plays a ``pygame.mixer.Sound``, returning the channel it's playing
+        on, or None if it was dropped.
+        """
+        if self.channels is None:
+            self._allocate()
+        channels = self.channels[settings.category]
+        busy = [channel for channel in channels if channel.get_busy()]
+        copies = [channel for channel in busy if self.voices[channel][0] is sound]
+        if len(copies) >= settings.limit:
+            channel = min(copies, key=lambda channel: self.voices[channel][2])
+            self.steals += 1
+        elif len(busy) < len(channels):
+            channel = next(channel for channel in channels if not channel.get_busy())
+        else:
+            candidates = [channel for channel in busy if self.voices[channel][1] <= settings.priority]
+            if not candidates:
+                self.dropped += 1
+                return None
+            channel = min(candidates, key=lambda channel: self.voices[channel][1:])
+            self.steals += 1
+        channel.play(sound)
+        self.voices[channel] = (sound, settings.priority, self.started)
+        self.started += 1
+        self.played += 1
+        return channel
+
+    def info(self):
+        return ChannelInfo(self.played, self.steals, self.dropped)
+
+    def latency(self):
+        """
+        Returns the mixer's output latency in seconds, from the buffer size
+        it was started with, or None if it isn't running.
+        """
+        mixer = pygame.mixer.get_init()
+        if not mixer or self.buffer is None:
+            return None
+        return self.buffer / mixer[0]
+
+
+channel_manager = ChannelManager()
+
+
+class ManagedSound(object):
+    """
+    A ``pygame.mixer.Sound`` which plays through the ``ChannelManager``.
+    """
+
+    def __init__(self, sound, settings=DEFAULT_SOUND_SETTINGS, manager=channel_manager):
+        self.sound = sound
+        self.settings = settings
+        self.manager = manager
+
+    def play(self):
+        return self.manager.play(self.sound, self.settings)
+
+    def stop(self):
+        self.sound.stop()
+
+    def fadeout(self, ms):
+        self.sound.fadeout(ms)
+
+    def set_volume(self, value):
+        self.sound.set_volume(value)
+
+    def get_volume(self):
+        return self.sound.get_volume()
+
+
+def init_audio(frequency=44100, buffer=512):
+    """
+    Starts the mixer. ``buffer`` is in samples; smaller buffers play
+    sounds sooner, but may crackle on slow machines.
+
+    Returns False if there is no audio device, in which case the game
+    runs silently, with every sound loading as a ``NullSound``.
+    """
+    pygame.mixer.pre_init(frequency=frequency, buffer=buffer)
+    try:
+        pygame.mixer.init()
+    except pygame.error:
+        return False
+    channel_manager.buffer = buffer
+    return True
+
+
+SoundCacheInfo = namedtuple('SoundCacheInfo', ['hits', 'misses', 'size'])
+
+# Decoded sounds are shared by every sprite that plays them. Playing a
+# ``Sound`` doesn't mutate it, so there's no need to hand out copies.
+_sound_cache = {}
+_sound_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def load_sound(path):
+    """
+    Returns the shared ``ManagedSound`` for the given path, or a
+    ``NullSound`` if the mixer has not been initialized (e.g. when
+    running headless).
+    """
+    if not pygame.mixer.get_init():
+        return NullSound()
+    if path in _sound_cache:
+        _sound_cache_stats['hits'] += 1
+    else:
+        _sound_cache_stats['misses'] += 1
         local_path = os.path.join(*path.split("/"))
-        image = pygame.image.load(local_path).convert_alpha()
-        _image_cache[path] = image
-    return _image_cache[path].copy()
+        settings = SOUND_SETTINGS.get(path, DEFAULT_SOUND_SETTINGS)
+        _sound_cache[path] = ManagedSound(pygame.mixer.Sound(local_path), settings)
+    return _sound_cache[path]
 
 
-class LaserUpdateMixin(object):
+def preload_sounds(paths=SOUND_FILES):
+    """
+    Decodes sound effects up front, so no file I/O happens during play.
+    """
+    for path in paths:
+        load_sound(path)
+
+
+def sound_cache_info():
+    """
+    Returns hit and miss counts for the sound cache. Once the sounds
+    are preloaded, misses should stay flat for the rest of the game.
     """
-    Updates sprite positions, and destroys them when they leave the
-    top of the screen.
+    return SoundCacheInfo(_sound_cache_stats['hits'],
+                          _sound_cache_stats['misses'],
+                          len(_sound_cache))
+
+
+TextCacheInfo = namedtuple('TextCacheInfo', ['hits', 'misses', 'size', 'maxsize'])
+
+
+class TextCache(object):
+    """
+    LRU cache of rendered text, keyed by font, string, antialiasing,
+    color and alpha. Text that doesn't change between frames is only
+    rasterized once, and after that costs a single blit.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color, alpha=None):
+        key = (font, text, antialias, color, alpha)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        if alpha is not None:
+            surface.set_alpha(alpha)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxsize:
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def info(self):
+        return TextCacheInfo(self.hits, self.misses, len(self.surfaces), self.maxsize)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+text_cache = TextCache()
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of ``values``, which must be sorted.
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct / 100. * (len(values) - 1))))]
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Phase(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, perf_counter() - self.start)
+        return False
+
+
+class FrameProfiler(object):
+    """
+    Times the phases of each frame (``with profiler.phase('update'):``),
+    and keeps the last ``window`` frames of each phase for rolling
+    percentiles. Phases may nest, e.g. ``update.lasers`` inside
+    ``update``.
+
+    When ``tracing`` is on, every phase is also kept so it can be written
+    out with ``write_trace``. While the profiler is disabled, ``phase``
+    hands out a shared no-op context manager and nothing is recorded.
+    """
+    _null_phase = _NullPhase()
+
+    def __init__(self, window=300):
+        self.enabled = False
+        self.tracing = False
+        self.window = window
+        self.samples = {}
+        self.current = {}
+        self.frame_number = 0
+        self.trace_events = []
+        self.frame_records = []
+
+    def phase(self, name):
+        if not self.enabled:
+            return self._null_phase
+        return _Phase(self, name)
+
+    def record(self, name, start, duration):
+        self.current[name] = self.current.get(name, 0) + duration
+        if self.tracing:
+            self.trace_events.append((name, start, duration))
+
+    def begin_frame(self):
+        self.current = {}
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        for name, duration in self.current.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(duration)
+        if self.tracing:
+            self.frame_records.append((self.frame_number, self.current))
+        self.frame_number += 1
+
+    def percentiles(self, name, pcts=(50, 95, 99)):
+        values = sorted(self.samples.get(name, ()))
+        return [percentile(values, pct) for pct in pcts]
+
+    def report_lines(self):
+        """
+        One line per phase, with p50/p95/p99 in milliseconds.
+        """
+        lines = []
+        for name in sorted(self.samples):
+            p50, p95, p99 = self.percentiles(name)
+            lines.append('{:<18} {:6.2f} {:6.2f} {:6.2f}'.format(name, p50 * 1000, p95 * 1000, p99 * 1000))
+        return lines
+
+    def write_trace(self, path):
+        """
+        Writes the recorded phases to ``path``; a CSV with one row per
+        frame if it ends in ``.csv``, otherwise a Chrome trace
+        (chrome://tracing, Perfetto) in JSON.
+        """
+        if path.endswith('.csv'):
+            names = sorted({name for frame, phases in self.frame_records for name in phases})
+            with open(path, 'w', newline='') as trace_file:
+                writer = csv.writer(trace_file)
+                writer.writerow(['frame'] + ['{} (ms)'.format(name) for name in names])
+                for frame, phases in self.frame_records:
+                    writer.writerow([frame] + ['{:.4f}'.format(phases.get(name, 0) * 1000) for name in names])
+            return
+        events = [
+            {'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+             'ts': round(start * 1e6, 1), 'dur': round(duration * 1e6, 1)}
+            for name, start, duration in self.trace_events
+        ]
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace_file)
+
+
+profiler = FrameProfiler()
+
+
+# Keys the player can hold down, in the order they're packed into a
+# recording's per-frame key mask.
+RECORDED_KEYS = (
+    pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN,
+    pygame.K_LSHIFT, pygame.K_SPACE, pygame.K_q,
+)
+
+
+class InputRecorder(object):
+    """
+    Wraps an input source, and records the keys held on every simulation
+    step along with the step's ``dt``. Together with the RNG seed that's
+    enough to play the same game back exactly.
+
+    Recordings are saved as a small header, followed by the zlib
+    compressed dts (float64) and key masks (one byte per step).
+    """
+    MAGIC = b'ASKR'
+    HEADER = struct.Struct('<4sBqI')
+    # Version 1 recordings drew hit effects from the gameplay ``rng``,
+    # and version 2 sized SpreadLaser hitboxes by their rotated image
+    VERSION = 3
+
+    def __init__(self, source, seed):
+        self.source = source
+        self.seed = seed
+        self.dts = array('d')
+        self.masks = bytearray()
+
+    def get_pressed(self):
+        keys = self.source.get_pressed()
+        mask = 0
+        for bit, key in enumerate(RECORDED_KEYS):
+            if keys[key]:
+                mask |= 1 << bit
+        self.masks.append(mask)
+        return keys
+
+    def step(self, dt):
+        self.dts.append(dt)
+
+    def save(self, path):
+        steps = min(len(self.dts), len(self.masks))
+        payload = self.dts[:steps].tobytes() + bytes(self.masks[:steps])
+        with open(path, 'wb') as recording:
+            recording.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.seed, steps))
+            recording.write(zlib.compress(payload, 9))
+
+
+class Replay(object):
+    """
+    A recording loaded back from disk.
+    """
+
+    def __init__(self, seed, dts, masks):
+        self.seed = seed
+        self.dts = dts
+        self.masks = masks
+
+    @classmethod
+    def load(cls, path):
+        header = InputRecorder.HEADER
+        with open(path, 'rb') as recording:
+            magic, version, seed, steps = header.unpack(recording.read(header.size))
+            if magic != InputRecorder.MAGIC or version != InputRecorder.VERSION:
+                raise ValueError('{} is not an AstroSky recording'.format(path))
+            payload = zlib.decompress(recording.read())
+        dts = array('d')
+        dts.frombytes(payload[:steps * dts.itemsize])
+        masks = payload[steps * dts.itemsize:]
+        return cls(seed, dts, masks)
+
+    def controls(self):
+        return ReplayInput(self.masks)
+
+
+class ReplayInput(object):
+    """
+    Input source that plays back the key masks from a recording.
+    """
+
+    def __init__(self, masks):
+        self.masks = masks
+        self.frame = 0
+
+    def seek(self, frame):
+        self.frame = frame
+
+    def get_pressed(self):
+        mask = self.masks[self.frame] if self.frame < len(self.masks) else 0
+        self.frame += 1
+        return PressedKeys(key for bit, key in enumerate(RECORDED_KEYS) if mask & (1 << bit))
+
+
+FrameTimeStats = namedtuple('FrameTimeStats', ['frames', 'total', 'mean', 'p50', 'p95', 'p99', 'max'])
+
+
+def frame_time_stats(times):
+    values = sorted(times)
+    if not values:
+        return FrameTimeStats(0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+    total = sum(values)
+    return FrameTimeStats(len(values), total, total / len(values), percentile(values, 50),
+                          percentile(values, 95), percentile(values, 99), values[-1])
+
+
+class MusicPlayer(object):
+    """
+    Streams background music from disk with ``pygame.mixer.music``, so
+    a track is never decoded into memory all at once.
+
+    ``pygame.mixer.music`` only streams one track at a time, so switching
+    tracks fades the current one out before fading the next one in. If
+    the requested track is already loaded (e.g. the last level repeating)
+    it is simply faded back in, without being reloaded.
+    """
+
+    def __init__(self, volume=0.9):
+        self.volume = volume
+        self.track = None
+        self.pending = None
+        self.gain = 0.0  # current fade level, 0 - 1
+        self.target_gain = 0.0
+        self.fade_speed = 1.0  # gain per second
+
+    def _set_fade(self, target, fade_ms):
+        self.target_gain = target
+        self.fade_speed = 1000. / fade_ms if fade_ms > 0 else float('inf')
+
+    def _start(self, path):
+        pygame.mixer.music.load(os.path.join(*path.split("/")))
+        pygame.mixer.music.set_volume(0)
+        pygame.mixer.music.play(loops=-1)
+        self.track = path
+        self.pending = None
+        self.gain = 0.0
+
+    def play(self, path, fade_ms=2000):
+        if not pygame.mixer.get_init():
+            return
+        if path == self.track:
+            self.pending = None
+            pygame.mixer.music.unpause()
+        elif self.track is None or self.gain == 0:
+            self._start(path)
+        else:
+            # Fade out whatever is playing, and pick up the new track
+            # in ``update`` once it's silent.
+            self.pending = path
+            self._set_fade(0.0, fade_ms / 2)
+            return
+        self._set_fade(1.0, fade_ms)
+
+    def fadeout(self, fade_ms):
+        self.pending = None
+        self._set_fade(0.0, fade_ms)
+
+    def get_volume(self):
+        return self.volume
+
+    def set_volume(self, value):
+        self.volume = min(max(value, 0.0), 1.0)
+
+    def update(self, dt):
+        if not pygame.mixer.get_init() or self.track is None:
+            return
+        step = self.fade_speed * dt
+        if self.gain < self.target_gain:
+            self.gain = min(self.gain + step, self.target_gain)
+        elif self.gain > self.target_gain:
+            self.gain = max(self.gain - step, self.target_gain)
+
+        if self.gain == 0 and self.target_gain == 0:
+            if self.pending is not None:
+                self._start(self.pending)
+                self._set_fade(1.0, 1000. / self.fade_speed * 2)
+            else:
+                pygame.mixer.music.pause()
+        pygame.mixer.music.set_volume(self.volume * self.gain)
+
+
+music = MusicPlayer()
+
+
+class KeyboardInput(object):
+    """
+    Reads the live keyboard state.
+    """
+
+    def get_pressed(self):
+        return pygame.key.get_pressed()
+
+
+class PressedKeys(frozenset):
+    """
+    A set of pressed key constants which can be indexed like the result
+    of ``pygame.key.get_pressed``.
+    """
+
+    def __getitem__(self, key):
+        return key in self
+
+
+class ScriptedInput(object):
+    """
+    Input source for headless runs. ``script`` is called with the frame
+    number, and returns the key constants held down on that frame.
+    """
+
+    def __init__(self, script=None):
+        self.script = script
+        self.frame = 0
+
+    def seek(self, frame):
+        self.frame = frame
+
+    def get_pressed(self):
+        if self.script is None:
+            keys = PressedKeys()
+        else:
+            keys = PressedKeys(self.script(self.frame))
+        self.frame += 1
+        return keys
+
+
+class BotInput(object):
+    """
+    A simple computer player for headless runs. It steers under the
+    lowest enemy above it, fires constantly, and blasts enemies that get
+    close. ``game`` must be set before the first frame.
+
+    ``skill`` is the chance of acting on each frame, so lower skill
+    players react late. The bot has its own random number generator, so
+    it doesn't disturb the game's.
+    """
+
+    def __init__(self, game=None, skill=1.0, seed=None):
+        self.game = game
+        self.skill = skill
+        self.rng = Random(seed)
+        self.keys = PressedKeys()
+
+    def get_pressed(self):
+        if self.rng.random() >= self.skill:
+            return self.keys
+        level = self.game.level
+        player = level.player
+        keys = [pygame.K_LSHIFT]
+        targets = [enemy for enemy in level.enemies
+                   if enemy.rect.bottom > 0 and enemy.rect.bottom < player.rect.top]
+        target_x = SCREEN_WIDTH / 2
+        if targets:
+            target = max(targets, key=lambda enemy: enemy.rect.bottom)
+            target_x = target.rect.centerx
+            if player.rect.top - target.rect.bottom < 200:
+                keys.append(pygame.K_q)
+        # The ship keeps its velocity, so thrust toward the speed that
+        # closes the gap, rather than toward the target itself.
+        speed = max(-600, min(600, (target_x - player.rect.centerx) * 4))
+        if player.dx < speed - player.HORIZONTAL_MOVE:
+            keys.append(pygame.K_RIGHT)
+        elif player.dx > speed + player.HORIZONTAL_MOVE:
+            keys.append(pygame.K_LEFT)
+        self.keys = PressedKeys(keys)
+        return self.keys
+
+
+class RotationAtlas(object):
+    """
+    Every rotation of an image, quantized to ``steps`` angles and rendered
+    once up front. Each frame is stored along with the offset from the
+    sprite's center to the frame's top-left corner, so a rotating sprite
+    only has to look up its frame and where to draw it from there.
+    """
+
+    def __init__(self, image, steps=64):
+        self.steps = steps
+        self.frames = []
+        for step in range(steps):
+            frame = pygame.transform.rotate(image, step * 360. / steps)
+            width, height = frame.get_size()
+            offset = (-(width // 2), -(height // 2))
+            self.frames.append((frame, offset))
+
+    def index(self, angle):
+        return int(round(angle * self.steps / 360.)) % self.steps
+
+    def frame(self, angle):
+        return self.frames[self.index(angle)]
+
+
+_rotation_cache = {}
+
+
+def load_rotation_atlas(path, size=None, steps=64):
+    """
+    Returns the shared ``RotationAtlas`` for an image, optionally scaled
+    to ``size`` before it's rotated.
+    """
+    key = (path, size, steps)
+    if key not in _rotation_cache:
+        image = load_image(path)
+        if size is not None:
+            image = pygame.transform.scale(image, size)
+        _rotation_cache[key] = RotationAtlas(image, steps)
+    return _rotation_cache[key]
+
+
+class ShrinkAnimation(object):
+    """
+    Frames of every rotation in ``atlas`` shrinking to nothing over
+    ``duration`` seconds, in ``steps`` sizes. Frames are looked up by
+    rotation index and time remaining, so sprites playing the animation
+    share its surfaces and never rescale anything themselves.
+    """
+
+    def __init__(self, atlas, duration, steps=12):
+        self.atlas = atlas
+        self.duration = duration
+        self.steps = steps
+        self.frames = []
+        for image, offset in atlas.frames:
+            width, height = image.get_size()
+            sizes = []
+            for step in range(1, steps + 1):
+                scale = step / steps
+                size = (max(round(width * scale), 1),
+                        max(round(height * scale), 1))
+                frame = pygame.transform.smoothscale(image, size)
+                sizes.append((frame, (-(size[0] // 2), -(size[1] // 2))))
+            self.frames.append(sizes)
+
+    def frame(self, rotation, remaining):
+        """
+        Returns the ``(image, offset)`` for the given rotation index with
+        ``remaining`` seconds left, or ``None`` once the animation is over.
+        """
+        if remaining <= 0:
+            return None
+        step = min(ceil(remaining * self.steps / self.duration), self.steps)
+        return self.frames[rotation][step - 1]
+
+
+_animation_cache = {}
+
+
+def load_shrink_animation(path, duration, rotations=16, steps=12):
+    key = (path, duration, rotations, steps)
+    if key not in _animation_cache:
+        atlas = load_rotation_atlas(path, steps=rotations)
+        _animation_cache[key] = ShrinkAnimation(atlas, duration, steps)
+    return _animation_cache[key]
+
+
+PoolInfo = namedtuple('PoolInfo', ['live', 'free'])
+
+
+class SpritePool(object):
+    """
+    Recycles killed sprites of one class, so that short lived sprites
+    (lasers, hit effects, enemies) don't have to be rebuilt from scratch
+    each time, and long sessions have a stable allocation profile.
+    """
+
+    def __init__(self, sprite_class):
+        self.sprite_class = sprite_class
+        self.free = []
+        self.created = 0
+
+    def acquire(self, *args, **kwargs):
+        if self.free:
+            sprite = self.free.pop()
+            sprite.reset(*args, **kwargs)
+        else:
+            sprite = self.sprite_class(*args, **kwargs)
+            self.created += 1
+        return sprite
+
+    def release(self, sprite):
+        self.free.append(sprite)
+
+    def info(self):
+        return PoolInfo(self.created - len(self.free), len(self.free))
+
+
+class PooledSpriteMixin(object):
+    """
+    Sprites which are handed back to their class's ``pool`` when killed.
+    Subclasses implement ``reset``, which takes the same arguments as
+    ``__init__`` and reinitializes a recycled sprite.
+
+    Must go before ``pygame.sprite.Sprite`` in MRO.
+    """
+    pool = None
+
+    @classmethod
+    def acquire(cls, *args, **kwargs):
+        return cls.pool.acquire(*args, **kwargs)
+
+    def kill(self):
+        alive = self.alive()
+        super().kill()
+        if alive:
+            self.pool.release(self)
+
+
+class MotionMixin(object):
+    """
+    Tracks a sprite's center as floats, so slow movement isn't lost to
+    ``Rect``'s integer coordinates, and remembers where the sprite was
+    before its last move, so it can be drawn part way between the two.
+    """
+
+    def place(self, center, previous_center=None):
+        """
+        Moves the sprite without interpolating from its old position,
+        unless a ``previous_center`` is given to interpolate from.
+        """
+        self.center = center
+        self.previous_center = center if previous_center is None else previous_center
+        self.rect.center = center
+
+    def move(self, dx, dy):
+        self.previous_center = self.center
+        self.center = (self.center[0] + dx, self.center[1] + dy)
+        self.rect.center = self.center
+
+    def interpolate(self, alpha):
+        """
+        Positions the rect ``alpha`` of the way from the previous
+        position to the current one. ``interpolate(1)`` restores it.
+        """
+        previous_x, previous_y = self.previous_center
+        x, y = self.center
+        self.rect.center = (previous_x + (x - previous_x) * alpha,
+                            previous_y + (y - previous_y) * alpha)
+
+
+class LaserUpdateMixin(MotionMixin):
+    """
+    Updates sprite positions, and destroys them once they're entirely
+    off screen, whichever edge they leave by.
 
     Must go first in MRO, since ``pygame.sprite.Sprite`` provides a
     no-op ``update`` method.
     """
 
     def update(self, dt):
-        self.rect.x, self.rect.y = (
-            (self.rect.x + self.dx * dt),
-            (self.rect.y + self.dy * dt)
-        )
-        if self.rect.bottom < 0:
+        self.move(self.dx * dt, self.dy * dt)
+        if not self.rect.colliderect(SCREEN_RECT):
             self.kill()
 
 
-class Laser(LaserUpdateMixin, pygame.sprite.Sprite):
+class Laser(LaserUpdateMixin, PooledSpriteMixin, pygame.sprite.Sprite):
+    image_file = 'assets/ssr/PNG/Lasers/laserBlue07.png'
 
     def __init__(self, start_position, *groups, dy=-400, dx=0):
-        super().__init__(*groups)
+        super().__init__()
+        self.image = load_image(self.image_file)
+        self.rect = self.image.get_rect()
+        # From the rect's center to its top-left, for ``CenteredGroup``
+        self.offset = (-(self.rect.width // 2), -(self.rect.height // 2))
+        self.reset(start_position, *groups, dy=dy, dx=dx)
+
+    def reset(self, start_position, *groups, dy=-400, dx=0):
         self.dy = dy
         self.dx = dx
-        self.image = load_image('assets/ssr/PNG/Lasers/laserBlue07.png')
-        self.rect = self.image.get_rect()
         self.rect.midbottom = start_position
+        self.place(self.rect.center)
+        self.add(*groups)
 
 
-class LaserHit(pygame.sprite.Sprite):
+class LaserHit(PooledSpriteMixin, pygame.sprite.Sprite):
     image_file = 'assets/ssr/PNG/Lasers/laserBlue08.png'
+    duration = 0.15
 
     def __init__(self, position, *groups):
-        super().__init__(*groups)
-        image = load_image('assets/ssr/PNG/Lasers/laserBlue08.png')
-        angle = randrange(1, 360)
-        self.image = pygame.transform.rotate(image, angle)
+        super().__init__()
+        self.animation = load_shrink_animation(self.image_file, self.duration)
+        self.reset(position, *groups)
+
+    def reset(self, position, *groups):
+        angle = effect_rng.randrange(1, 360)
+        self.rotation = self.animation.atlas.index(angle)
+        self.lifespan = self.duration
+        self.image = self.animation.frame(self.rotation, self.lifespan)[0]
         self.rect = self.image.get_rect()
         self.rect.center = position
-        self.lifespan = 0.15
-        self.original_width = self.rect.width
-        self.original_height = self.rect.height
-        self.width_scale_factor = self.rect.width / self.lifespan
-        self.height_scale_factor = self.rect.height / self.lifespan
+        self.add(*groups)
 
     def update(self, dt):
         self.lifespan -= dt
-        width = max(round(self.width_scale_factor * self.lifespan), 0)
-        height = max(round(self.height_scale_factor * self.lifespan), 0)
-        if not any((width, height)):
+        frame = self.animation.frame(self.rotation, self.lifespan)
+        if frame is None:
             self.kill()
             return
-        self.image = pygame.transform.scale(self.image, (width, height))
-        self.rect = self.image.get_rect(center=self.rect.center)
-        if self.lifespan < 0:
-            self.kill()
+        self.image, (offset_x, offset_y) = frame
+        center_x, center_y = self.rect.center
+        self.rect.update(center_x + offset_x, center_y + offset_y,
+                         *self.image.get_size())
 
 
-class SpreadLaser(LaserUpdateMixin, pygame.sprite.Sprite):
+class SpreadLaser(LaserUpdateMixin, PooledSpriteMixin, pygame.sprite.Sprite):
+    """
+    A spinning laser. Its rect is the unrotated image's, whatever the
+    rotation, so how many steps the atlas has only changes how it looks,
+    never what it hits. Drawn centered on its rect by ``CenteredGroup``.
+    """
     image_file = 'assets/ssr/PNG/Lasers/laserBlue08.png'
 
-    def __init__(self, position, *groups, dx=0, dy=-400):
-        super().__init__(*groups)
+    def __init__(self, position, *groups, dx=0, dy=-400, steps=64):
+        super().__init__()
+        self.reset(position, *groups, dx=dx, dy=dy, steps=steps)
+
+    def reset(self, position, *groups, dx=0, dy=-400, steps=64):
+        self.atlas = load_rotation_atlas(self.image_file, size=(24, 23), steps=steps)
         self.dx, self.dy = dx, dy
         self.angle = 0
-        image = load_image('assets/ssr/PNG/Lasers/laserBlue08.png')
-        self.image_master = pygame.transform.scale(image, (24, 23))
-        self.image = self.image_master
+        self.image, self.offset = self.atlas.frame(self.angle)
         self.rect = pygame.rect.Rect(position, self.image.get_size())
+        self.place(self.rect.center)
+        self.add(*groups)
 
     def update(self, dt):
         self.angle += 230 * dt
-        self.image = pygame.transform.rotate(self.image_master, self.angle)
-        self.rect = self.image.get_rect(center=self.rect.center)
+        self.image, self.offset = self.atlas.frame(self.angle)
         super().update(dt)
 
 
+class CenteredGroup(pygame.sprite.Group):
+    """
+    Sprite group that draws each image centered on its sprite's rect,
+    for sprites whose rect is a hitbox rather than the image's bounds.
+    Sprites give their image's ``offset`` from the rect's center to its
+    top-left corner, e.g. from a ``RotationAtlas`` frame.
+    """
+
+    def draw(self, surface):
+        sprites = self.sprites()
+        blits = []
+        for sprite in sprites:
+            center_x, center_y = sprite.rect.center
+            offset_x, offset_y = sprite.offset
+            blits.append((sprite.image, (center_x + offset_x, center_y + offset_y)))
+        self.spritedict.update(zip(sprites, surface.blits(blits)))
+        self.lostsprites = []
+        return list(self.spritedict.values())
+
+
+class ProjectileSystem(object):
+    """
+    Plain lasers, kept as a struct of NumPy arrays instead of a sprite
+    each. All projectiles are moved and culled in one vectorized step,
+    and drawn with a single ``Surface.blits`` call, which keeps bullet
+    hell densities cheap.
+
+    Positions are float centers, rounded to rects the same way
+    ``MotionMixin`` sprites are, so projectiles move and collide exactly
+    like ``Laser`` sprites.
+    """
+    fields = ('x', 'y', 'previous_x', 'previous_y', 'dx', 'dy')
+
+    def __init__(self, image, capacity=256):
+        self.image = image
+        self.width, self.height = image.get_size()
+        self.count = 0
+        for field in self.fields:
+            setattr(self, field, numpy.zeros(capacity))
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        for field in self.fields:
+            array = getattr(self, field)
+            grown = numpy.zeros(len(array) * 2)
+            grown[:self.count] = array[:self.count]
+            setattr(self, field, grown)
+
+    def _keep(self, keep):
+        """
+        Compacts the arrays down to the projectiles where ``keep`` is set.
+        """
+        kept = int(numpy.count_nonzero(keep))
+        for field in self.fields:
+            array = getattr(self, field)
+            array[:kept] = array[:self.count][keep]
+        self.count = kept
+
+    def add(self, midbottom, dx=0, dy=-400):
+        if self.count == len(self.x):
+            self._grow()
+        # Start from the same integer center a ``Laser`` would
+        center = self.image.get_rect(midbottom=midbottom).center
+        index = self.count
+        self.x[index] = self.previous_x[index] = center[0]
+        self.y[index] = self.previous_y[index] = center[1]
+        self.dx[index] = dx
+        self.dy[index] = dy
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def _topleft(self, x, y):
+        # Rounded half away from zero, the same as setting ``Rect.center``
+        left = (numpy.sign(x) * numpy.floor(numpy.abs(x) + 0.5)).astype(numpy.intp) - self.width // 2
+        top = (numpy.sign(y) * numpy.floor(numpy.abs(y) + 0.5)).astype(numpy.intp) - self.height // 2
+        return left, top
+
+    def update(self, dt):
+        count = self.count
+        if not count:
+            return
+        x, y = self.x[:count], self.y[:count]
+        self.previous_x[:count] = x
+        self.previous_y[:count] = y
+        x += self.dx[:count] * dt
+        y += self.dy[:count] * dt
+        # Cull anything that's entirely off screen
+        left, top = self._topleft(x, y)
+        visible = ((left < SCREEN_WIDTH) & (left + self.width > 0)
+                   & (top < SCREEN_HEIGHT) & (top + self.height > 0))
+        if not visible.all():
+            self._keep(visible)
+
+    def collide(self, enemies, masks=False):
+        """
+        Removes every projectile that hit an enemy, and returns a dict of
+        enemy to the midtop positions of the projectiles that hit it.
+        Like ``groupcollide``, a projectile only counts for the first
+        enemy it hits. With ``masks``, overlapping rects are also checked
+        pixel by pixel, like ``collide_mask_cached``.
+        """
+        count = self.count
+        sprites = enemies.sprites()
+        if not count or not sprites:
+            return {}
+        left, top = self._topleft(self.x[:count], self.y[:count])
+        right, bottom = left + self.width, top + self.height
+        alive = numpy.ones(count, dtype=bool)
+        hits = {}
+        # Test enemies in chunks, to bound the size of the overlap matrix
+        for start in range(0, len(sprites), 256):
+            chunk = sprites[start:start + 256]
+            rects = numpy.array([tuple(sprite.rect) for sprite in chunk]).reshape(-1, 4)
+            enemy_left, enemy_top = rects[:, 0:1], rects[:, 1:2]
+            enemy_right, enemy_bottom = enemy_left + rects[:, 2:3], enemy_top + rects[:, 3:4]
+            overlap = ((left < enemy_right) & (right > enemy_left)
+                       & (top < enemy_bottom) & (bottom > enemy_top))
+            for row in numpy.flatnonzero(overlap.any(axis=1)):
+                indices = numpy.flatnonzero(overlap[row] & alive)
+                if masks and len(indices):
+                    enemy = chunk[row]
+                    enemy_mask, mask = image_mask(enemy.image), image_mask(self.image)
+                    indices = [index for index in indices.tolist()
+                               if enemy_mask.overlap(mask, (int(left[index]) - enemy.rect.x,
+                                                            int(top[index]) - enemy.rect.y))]
+                if not len(indices):
+                    continue
+                alive[indices] = False
+                hits[chunk[row]] = [(int(left[index]) + self.width // 2, int(top[index]))
+                                    for index in indices]
+        if hits:
+            self._keep(alive)
+        return hits
+
+    def draw(self, screen, alpha=None, dirty=None):
+        count = self.count
+        if not count:
+            return
+        x, y = self.x[:count], self.y[:count]
+        if alpha is not None:
+            previous_x, previous_y = self.previous_x[:count], self.previous_y[:count]
+            x = previous_x + (x - previous_x) * alpha
+            y = previous_y + (y - previous_y) * alpha
+        left, top = self._topleft(x, y)
+        image = self.image
+        blits = [(image, position) for position in zip(left.tolist(), top.tolist())]
+        if dirty is None:
+            screen.blits(blits, doreturn=False)
+        else:
+            dirty.extend(screen.blits(blits))
+
+
+_mask_cache = weakref.WeakKeyDictionary()
+
+
+def image_mask(image):
+    """
+    Returns the collision mask for an image surface, built once and
+    shared by every sprite using that image.
+    """
+    mask = _mask_cache.get(image)
+    if mask is None:
+        mask = _mask_cache[image] = pygame.mask.from_surface(image)
+    return mask
+
+
+def collide_mask_cached(left, right):
+    """
+    Like ``pygame.sprite.collide_mask``, but masks are built once per
+    image surface and shared by every sprite using that image.
+    """
+    offset = (right.rect.x - left.rect.x, right.rect.y - left.rect.y)
+    return image_mask(left.image).overlap(image_mask(right.image), offset) is not None
+
+
+def sweep_groupcollide(groupa, groupb, dokilla, dokillb, collided=None):
+    """
+    Same as ``pygame.sprite.groupcollide``, and returns the same
+    mapping, but with a sweep and prune broad phase. Sprites in
+    ``groupb`` are sorted by their left edge once, so each sprite in
+    ``groupa`` only tests the run of sprites that overlap it
+    horizontally, instead of the whole of ``groupb``.
+
+    ``collided`` is an optional narrow phase check, run on pairs whose
+    rects overlap (e.g. ``collide_mask_cached``).
+    """
+    others = sorted((sprite.rect.left, index, sprite) for index, sprite in enumerate(groupb))
+    if not others:
+        return {}
+    lefts = [left for left, index, sprite in others]
+    rects = [sprite.rect for left, index, sprite in others]
+    max_width = max(rect.width for rect in rects)
+
+    crashed = {}
+    killed = set()
+    for sprite in groupa.sprites():
+        rect = sprite.rect
+        start = bisect_left(lefts, rect.left - max_width + 1)
+        end = bisect_left(lefts, rect.right, start)
+        if start == end:
+            continue
+        # Keep groupb's order, so results match ``groupcollide``
+        candidates = sorted(others[start + i][1:] for i in rect.collidelistall(rects[start:end]))
+        hits = []
+        for index, other in candidates:
+            if other in killed:
+                continue
+            if collided is not None and not collided(sprite, other):
+                continue
+            hits.append(other)
+        if not hits:
+            continue
+        crashed[sprite] = hits
+        if dokillb:
+            for other in hits:
+                other.kill()
+                killed.add(other)
+        if dokilla:
+            sprite.kill()
+    return crashed
+
+
 Ability = namedtuple('Ability', ['label', 'cooldown', 'cooldown_state'])
 
 
-class Player(pygame.sprite.Sprite):
+class Player(MotionMixin, pygame.sprite.Sprite):
     HORIZONTAL_MOVE = 15
     VERTICAL_MOVE = 5
     img = 'assets/ssr/PNG/playerShip1_orange.png'
@@ -119,15 +1402,17 @@ class Player(pygame.sprite.Sprite):
         10: {'laser_1_cooldown': 0.11},
     }
 
-    def __init__(self, start_position, *groups):
+    def __init__(self, start_position, *groups, controls=None):
         super().__init__(*groups)
         self.image = load_image(self.img)
         self.rect = pygame.rect.Rect(start_position, self.image.get_size())
-        self.collide = pygame.mixer.Sound('assets/sound/collide_1.wav')
-        self.laser_1 = pygame.mixer.Sound('assets/sound/laser_1.wav')
-        self.q_sound = pygame.mixer.Sound('assets/sound/laser_3.wav')
-        self.burst_effect = pygame.mixer.Sound('assets/sound/burst.wav')
-        self.powerup_sound = pygame.mixer.Sound('assets/sound/powerup_1.wav')
+        self.place(self.rect.center)
+        self.controls = controls or KeyboardInput()
+        self.collide = load_sound('assets/sound/collide_1.wav')
+        self.laser_1 = load_sound('assets/sound/laser_1.wav')
+        self.q_sound = load_sound('assets/sound/laser_3.wav')
+        self.burst_effect = load_sound('assets/sound/burst.wav')
+        self.powerup_sound = load_sound('assets/sound/powerup_1.wav')
         self.laser_1_cooldown = 0.2
         self.laser_1_cooldown_state = 0
         self.burst_cooldown = 3
@@ -157,17 +1442,18 @@ class Player(pygame.sprite.Sprite):
         self.laser_1.play()
         self.laser_1_cooldown_state = self.laser_1_cooldown
         if self.level < 6:
-            game.lasers.add(Laser(self.rect.midtop))
+            game.fire_laser(self.rect.midtop)
         else:
-            game.lasers.add(Laser(self.rect.midleft))
-            game.lasers.add(Laser(self.rect.midright))
+            game.fire_laser(self.rect.midleft)
+            game.fire_laser(self.rect.midright)
 
     def q(self, game):
         if self.q_cooldown_state == 0:
             self.q_sound.play()
             self.q_cooldown_state = self.q_cooldown
-            game.lasers.add(SpreadLaser(self.rect.topleft, dy=-70, dx=-330))
-            game.lasers.add(SpreadLaser(self.rect.topright, dy=-70, dx=330))
+            steps = game.quality.rotation_steps
+            SpreadLaser.acquire(self.rect.topleft, game.lasers, dy=-70, dx=-330, steps=steps)
+            SpreadLaser.acquire(self.rect.topright, game.lasers, dy=-70, dx=330, steps=steps)
 
     def burst(self):
         """
@@ -192,7 +1478,7 @@ class Player(pygame.sprite.Sprite):
                 setattr(self, attr, value)
 
     def update(self, dt, game):
-        keys = pygame.key.get_pressed()
+        keys = self.controls.get_pressed()
         if keys[pygame.K_LEFT]:
             self.thrust_left(dt)
 
@@ -214,10 +1500,7 @@ class Player(pygame.sprite.Sprite):
         if keys[pygame.K_q]:
             self.q(game)
 
-        self.rect.x, self.rect.y = (
-            (self.rect.x + self.dx * dt),
-            (self.rect.y + self.dy * dt)
-        )
+        self.move(self.dx * dt, self.dy * dt)
 
         # Bounce off the sides of the screen, and reduce absolute velocity.
         # If the hit is hard enough, play collision sound
@@ -244,20 +1527,29 @@ class Player(pygame.sprite.Sprite):
         )
 
 
-class Enemy(pygame.sprite.Sprite):
+class Enemy(MotionMixin, PooledSpriteMixin, pygame.sprite.Sprite):
     points = 100
+    max_hp = 1
 
     def __init__(self, image, start_position, *groups, dy=50):
-        super().__init__(*groups)
+        super().__init__()
+        self.explosion_sound = load_sound('assets/sound/explosion_1.wav')
+        self.reset(image, start_position, *groups, dy=dy)
+
+    def reset(self, image, start_position, *groups, dy=50):
         self.dy = dy
         self.image = image
         self.rect = pygame.rect.Rect(start_position, self.image.get_size())
-        self.explosion_sound = pygame.mixer.Sound('assets/sound/explosion_1.wav')
-        self.hp = 1
+        self.place(self.rect.center)
+        self.hp = self.max_hp
+        self.add(*groups)
 
     def update(self, dt):
-        self.rect.y += self.dy * dt
-        if self.rect.top > SCREEN_HEIGHT:
+        self.move(0, self.dy * dt)
+        # Enemies spawn above the screen, so only cull them once they're
+        # past the bottom, or entirely off either side.
+        if (self.rect.top > SCREEN_HEIGHT or self.rect.right < 0
+                or self.rect.left > SCREEN_WIDTH):
             self.kill()
 
     def hit(self):
@@ -274,62 +1566,100 @@ class Enemy(pygame.sprite.Sprite):
 
 class BiggerEnemy(Enemy):
     points = 300
+    max_hp = 5
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.hp = 5
+
+Laser.pool = SpritePool(Laser)
+LaserHit.pool = SpritePool(LaserHit)
+SpreadLaser.pool = SpritePool(SpreadLaser)
+Enemy.pool = SpritePool(Enemy)
+BiggerEnemy.pool = SpritePool(BiggerEnemy)
+POOLED_SPRITES = (Laser, LaserHit, SpreadLaser, Enemy, BiggerEnemy)
+
+
+def pool_info():
+    """
+    Returns live and free sprite counts, summed across all pools.
+    """
+    infos = [cls.pool.info() for cls in POOLED_SPRITES]
+    return PoolInfo(sum(info.live for info in infos), sum(info.free for info in infos))
 
 
 class EnemyFactory(object):
+    image_files = {
+        'black': 'assets/ssr/PNG/Enemies/enemyBlack3.png',
+        'blue': 'assets/ssr/PNG/Enemies/enemyBlue3.png',
+        'green': 'assets/ssr/PNG/Enemies/enemyGreen3.png',
+        'red': 'assets/ssr/ssr_ex/Ships/spaceShips_008.png',
+    }
+    scale = (int(103 * 0.8), int(84 * 0.8))
+
     def __init__(self):
-        sf = 0.8
-        scale = (int(103 * sf), int(84 * sf))
         self.images = {
-            'black': pygame.transform.scale(load_image('assets/ssr/PNG/Enemies/enemyBlack3.png'), scale),
-            'blue': pygame.transform.scale(load_image('assets/ssr/PNG/Enemies/enemyBlue3.png'), scale),
-            'green': pygame.transform.scale(load_image('assets/ssr/PNG/Enemies/enemyGreen3.png'), scale),
-            'red': pygame.transform.scale(load_image('assets/ssr/ssr_ex/Ships/spaceShips_008.png'), scale)
+            color: load_scaled_image(path, self.scale)
+            for color, path in self.image_files.items()
         }
 
     def spawn(self, position, *groups, color=None, **kwargs):
         if color is None:
             color = choice(list(self.images.keys()))
-        image = self.images[color].copy()
-        return Enemy(image, position, *groups, **kwargs)
+        return Enemy.acquire(self.images[color], position, *groups, **kwargs)
 
 
 class BiggerEnemyFactory(object):
+    image_files = {
+        'black': 'assets/ssr/PNG/Enemies/enemyBlack4.png',
+        'blue': 'assets/ssr/PNG/Enemies/enemyBlue4.png',
+        'green': 'assets/ssr/PNG/Enemies/enemyGreen4.png',
+        'red': 'assets/ssr/ssr_ex/Ships/spaceShips_004.png',
+    }
+
     def __init__(self):
-        self.images = {
-            'black': load_image('assets/ssr/PNG/Enemies/enemyBlack4.png'),
-            'blue': load_image('assets/ssr/PNG/Enemies/enemyBlue4.png'),
-            'green': load_image('assets/ssr/PNG/Enemies/enemyGreen4.png'),
-            'red': load_image('assets/ssr/ssr_ex/Ships/spaceShips_004.png')
-        }
+        self._images = None
+
+    @property
+    def loaded(self):
+        return self._images is not None
+
+    @property
+    def images(self):
+        # Bigger enemies don't show up until the first wave spawns, a few
+        # seconds into the level, so their images are loaded on demand.
+        if self._images is None:
+            self._images = {
+                color: load_image(path)
+                for color, path in self.image_files.items()
+            }
+        return self._images
 
     def spawn(self, position, *groups, color=None, **kwargs):
         if color is None:
             color = choice(list(self.images.keys()))
-        image = self.images[color].copy()
-        return BiggerEnemy(image, position, *groups, **kwargs)
+        return BiggerEnemy.acquire(self.images[color], position, *groups, **kwargs)
+
+
+# (speed, size, color) for each layer of the starfield
+STAR_TIERS = [
+    (4, 1, (100, 100, 100)),
+    (6, 1, (120, 120, 120)),
+    (8, 1, (180, 180, 180))
+]
 
 
 class Star(object):
-    def __init__(self, bounds):
+    def __init__(self, bounds, rng):
         self.bounds = bounds
-        self.y = randrange(self.bounds.top, self.bounds.bottom - 1)
+        self.rng = rng
+        self.y = rng.randrange(self.bounds.top, self.bounds.bottom - 1)
         self._randomize()
 
     def _randomize(self):
-        self.x = randrange(self.bounds.left, self.bounds.right)
-        self.dy, self.size, self.color = choice([
-            (4, 1, (100, 100, 100)),
-            (6, 1, (120, 120, 120)),
-            (8, 1, (180, 180, 180))
-        ])
+        self.x = self.rng.randrange(self.bounds.left, self.bounds.right)
+        self.dy, self.size, self.color = self.rng.choice(STAR_TIERS)
 
-    def draw(self, screen):
-        screen.fill(self.color, (self.x, self.y, self.size, self.size))
+    def draw(self, screen, offset=(0, 0)):
+        return screen.fill(self.color, (self.x + offset[0], self.y + offset[1],
+                                        self.size, self.size))
 
     def update(self, dt):
         self.y += self.dy * dt
@@ -339,41 +1669,153 @@ class Star(object):
 
 
 class Starfield(object):
-    def __init__(self, bounding_rect, max_stars=300):
+    def __init__(self, bounding_rect, max_stars=300, rng=None):
+        # The starfield is purely cosmetic, so it gets its own generator
+        # rather than drawing from (and perturbing) the gameplay ``rng``.
+        rng = rng or Random()
         self.stars = []
+        self.drawn = []
         for _ in range(max_stars):
-            star = Star(bounding_rect)
+            star = Star(bounding_rect, rng)
             self.stars.append(star)
+        self.active = self.stars
+
+    def set_density(self, density):
+        """
+        Only updates and draws ``density`` (0 to 1) of the stars.
+        """
+        self.active = self.stars[:round(len(self.stars) * density)]
+        self.drawn = []
 
     def update(self, dt):
-        for star in self.stars:
+        for star in self.active:
             star.update(dt)
 
-    def draw(self, screen):
-        for star in self.stars:
-            star.draw(screen)
+    def draw(self, screen, offset=(0, 0), dirty=None):
+        """
+        If ``dirty`` is given, the regions of any stars that moved since
+        the last draw are added to it.
+        """
+        if dirty is None:
+            for star in self.active:
+                star.draw(screen, offset)
+            return
+        drawn = [star.draw(screen, offset) for star in self.active]
+        for previous, current in zip(self.drawn, drawn):
+            if previous != current:
+                dirty.append(previous)
+                dirty.append(current)
+        self.drawn = drawn
+
+
+class ArrayStarfield(object):
+    """
+    Starfield backed by NumPy arrays. Positions, speeds and color tiers
+    are updated in one vectorized step, and stars are written straight
+    into the target surface's pixels, so it copes with thousands of
+    stars. Behaves like ``Starfield`` otherwise; stars are 1px in size.
+    """
+
+    def __init__(self, bounding_rect, max_stars=300, rng=None, tiers=STAR_TIERS):
+        rng = rng or Random()
+        self.bounds = pygame.rect.Rect(bounding_rect)
+        self.random = numpy.random.default_rng(rng.getrandbits(64))
+        self.speeds = numpy.array([speed for speed, size, color in tiers], dtype=numpy.float32)
+        self.colors = [color for speed, size, color in tiers]
+        self.x = self.random.integers(self.bounds.left, self.bounds.right, max_stars)
+        self.y = self.random.integers(self.bounds.top, self.bounds.bottom - 1, max_stars).astype(numpy.float32)
+        self.tier = self.random.integers(0, len(tiers), max_stars)
+        self.active = max_stars
+        self.drawn = None
+
+    def set_density(self, density):
+        """
+        Only updates and draws ``density`` (0 to 1) of the stars.
+        """
+        self.active = round(len(self.x) * density)
+        self.drawn = None
+
+    def update(self, dt):
+        x, y, tier = self.x[:self.active], self.y[:self.active], self.tier[:self.active]
+        y += self.speeds[tier] * dt
+        wrapped = numpy.flatnonzero(y >= self.bounds.bottom)
+        if len(wrapped):
+            y[wrapped] = self.bounds.top
+            x[wrapped] = self.random.integers(self.bounds.left, self.bounds.right, len(wrapped))
+            tier[wrapped] = self.random.integers(0, len(self.colors), len(wrapped))
+
+    def draw(self, screen, offset=(0, 0), dirty=None):
+        width, height = screen.get_size()
+        tier = self.tier[:self.active]
+        x = self.x[:self.active] + offset[0]
+        y = self.y[:self.active].astype(numpy.intp) + offset[1]
+        visible = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        if dirty is not None:
+            if self.drawn is not None:
+                previous_x, previous_y = self.drawn
+                for index in numpy.flatnonzero((x != previous_x) | (y != previous_y)):
+                    dirty.append((previous_x[index], previous_y[index], 1, 1))
+                    dirty.append((x[index], y[index], 1, 1))
+            self.drawn = (x, y)
+        colors = numpy.array([screen.map_rgb(color) for color in self.colors], dtype=numpy.uint32)
+        try:
+            pixels = pygame.surfarray.pixels2d(screen)
+        except ValueError:
+            # 24 bit surfaces can't be referenced as a 2d array
+            for sx, sy, star_tier in zip(x[visible], y[visible], tier[visible]):
+                screen.set_at((sx, sy), self.colors[star_tier])
+            return
+        pixels[x[visible], y[visible]] = colors[tier[visible]]
+        del pixels  # unlock the surface
+
+
+def make_starfield(bounding_rect, max_stars=300, rng=None):
+    """
+    Returns an ``ArrayStarfield`` if NumPy is available, otherwise the
+    plain Python ``Starfield``.
+    """
+    if numpy is None:
+        return Starfield(bounding_rect, max_stars, rng)
+    return ArrayStarfield(bounding_rect, max_stars, rng)
 
 
 class Background(object):
-    def __init__(self, image_path):
-        self.image = load_image(image_path)
+    def __init__(self, image_path, max_stars=300):
+        self.image = load_opaque_image(image_path)
         self.rect = pygame.rect.Rect((0, 0), self.image.get_size())
         self.rect.centerx = SCREEN_RECT.centerx
-        self.starfield = Starfield(self.rect)
+        self.starfield = make_starfield(self.rect, max_stars)
         self.show_starfield = True
+        self.star_density = 1
+        self.parallax = True
+        self.drawn_state = None
+
+    def set_quality(self, quality):
+        if quality.stars != self.star_density:
+            self.star_density = quality.stars
+            self.starfield.set_density(quality.stars)
+        self.parallax = quality.parallax
 
     def update(self, dt, player):
-        player_offset = SCREEN_RECT.centerx - player.rect.centerx
+        player_offset = SCREEN_RECT.centerx - player.rect.centerx if self.parallax else 0
         self.rect.centerx = SCREEN_RECT.centerx + (player_offset * 0.03)
         if self.show_starfield:
             self.starfield.update(dt)
 
-    def draw(self, screen):
-        surface = pygame.Surface(self.rect.size)
-        surface.blit(self.image, (0, 0))
+    def draw(self, screen, dirty=None):
+        # Only copy the part of the image that's actually on screen, and
+        # draw the stars straight onto the screen, offset by the parallax
+        # position of the background.
+        viewport = SCREEN_RECT.move(-self.rect.x, -self.rect.y)
+        screen.blit(self.image, (0, 0), viewport)
+        if dirty is not None:
+            # The whole screen changes whenever the parallax offset does
+            state = (self.rect.topleft, self.show_starfield, self.star_density)
+            if state != self.drawn_state:
+                dirty.append(SCREEN_RECT)
+                self.drawn_state = state
         if self.show_starfield:
-            self.starfield.draw(surface)
-        screen.blit(surface, self.rect)
+            self.starfield.draw(screen, self.rect.topleft, dirty)
 
     def toggle_starfield(self):
         self.show_starfield = not self.show_starfield
@@ -385,14 +1827,13 @@ class ScoreDisplay(object):
         self.color = (200, 200, 200)
 
     def draw(self, font, screen):
-        surface = font.render(self.text, True, self.color)
-        surface.set_alpha(150)
-        screen.blit(surface, self.position)
+        surface = text_cache.render(font, self.text, True, self.color, alpha=150)
+        return screen.blit(surface, self.position)
 
 
 class ScoreDisplayGroup(object):
     def __init__(self):
-        self.font = pygame.font.Font('assets/ssr/Bonus/kenvector_future.ttf', 20)
+        self.font = load_font('assets/ssr/Bonus/kenvector_future.ttf', 20)
         self.scores = []
 
     def add(self, text, position):
@@ -409,8 +1850,91 @@ class ScoreDisplayGroup(object):
         self.scores = new_scores
 
     def draw(self, screen):
-        for score in self.scores:
-            score.draw(self.font, screen)
+        return [score.draw(self.font, screen) for score in self.scores]
+
+
+class CooldownPanel(object):
+    """
+    Displays ability cooldowns along the bottom of the screen.
+
+    The panel is kept on a persistent surface, and an ability's bar is
+    only redrawn when its displayed width changes, so while nothing is
+    cooling down drawing the panel is a single blit.
+
+    Each ability requires the following properties:
+
+    .cooldown: Cooldown time for the ability
+    .cooldown_state: Current time remaining before the ability is off cooldown
+    .label: Name of the ability
+    """
+    HEIGHT = 40
+    MARGIN = 10
+    BORDER = 2
+    ABILITY_WIDTH = 140
+    ABILITY_COLOR = (200, 200, 200, 255)
+    BACKGROUND_COLOR = (100, 100, 100, 60)
+
+    def __init__(self, font):
+        self.font = font
+        self.topleft = (0, SCREEN_HEIGHT - self.HEIGHT)
+        self.surface = pygame.Surface((SCREEN_WIDTH, self.HEIGHT), pygame.SRCALPHA)
+        self.surface.fill(self.BACKGROUND_COLOR)
+        self.ability_surface = pygame.Surface(
+            (self.ABILITY_WIDTH, self.HEIGHT - self.MARGIN), pygame.SRCALPHA)
+        self.displayed = []  # (label, empty width) last drawn in each slot
+
+    def _empty_width(self, ability):
+        """
+        Width of the block carved out of the bar to show the cooldown,
+        in whole pixels.
+        """
+        if ability.cooldown_state == 0:
+            return 0
+        empty_width = int((self.ABILITY_WIDTH * ability.cooldown_state) / ability.cooldown)
+        return empty_width if empty_width >= 1 else 0
+
+    def _draw_ability(self, label, empty_width):
+        surface = self.ability_surface
+        surface.fill((0, 0, 0, 0))
+        surface.blit(text_cache.render(self.font, label, True, self.ABILITY_COLOR), (0, 0))
+        width = surface.get_width()
+        background_position = (0, self.font.get_height() + 2)
+        background_height = surface.get_height() / 2
+        background = pygame.Rect(background_position, (width, background_height))
+        surface.fill(self.ABILITY_COLOR, background)
+
+        if not empty_width:
+            return
+
+        # Display the cooldown by carving a transparant block out of the
+        # ability display background rectangle
+        empty_topleft = (background_position[0] + self.BORDER,
+                         background_position[1] + self.BORDER)
+        empty_height = background_height - (self.BORDER * 2)
+        empty = pygame.Rect(empty_topleft, (empty_width, empty_height))
+        empty.right = width - self.BORDER
+        surface.fill((255, 255, 255, 255), empty, pygame.BLEND_RGBA_SUB)
+
+    def draw(self, screen, abilities):
+        """
+        Returns True if the panel looks any different from last time.
+        """
+        changed = False
+        x = self.MARGIN
+        for slot, ability in enumerate(abilities):
+            state = (ability.label, self._empty_width(ability))
+            if slot >= len(self.displayed):
+                self.displayed.append(None)
+            if self.displayed[slot] != state:
+                self._draw_ability(*state)
+                slot_rect = pygame.Rect((x, 2), self.ability_surface.get_size())
+                self.surface.fill(self.BACKGROUND_COLOR, slot_rect)
+                self.surface.blit(self.ability_surface, slot_rect)
+                self.displayed[slot] = state
+                changed = True
+            x = x + self.ABILITY_WIDTH + self.MARGIN
+        screen.blit(self.surface, self.topleft)
+        return changed
 
 
 class Level(object):
@@ -419,27 +1943,34 @@ class Level(object):
         background_music = config.get('background_music', 'assets/sound/music/DigitalNativeLooped.ogg')
         background_image = config.get('background_image', 'assets/art/spacefield1600x1000.png')
         self.enemy_colors = config.get('enemy_colors', ['blue', 'green'])
-        self.ability_font = pygame.font.Font('assets/ssr/Bonus/kenvector_future_thin.ttf', 10)
+        self.ability_font = load_font('assets/ssr/Bonus/kenvector_future_thin.ttf', 10)
+        self.cooldown_panel = CooldownPanel(self.ability_font)
         self.end_score = config.get('end_score', 3000)
+        # Optional pixel-perfect check for enemy / laser collisions
+        self.collided = collide_mask_cached if config.get('collision_masks') else None
+        controls = config.get('controls')
         self.player_powerup = 0
         self.sprites = pygame.sprite.Group()
         self.score_display_group = ScoreDisplayGroup()
 
-        self.background = Background(background_image)
+        self.background = Background(background_image, config.get('max_stars', 300))
+        self.quality = QUALITY_TIERS[-1]
 
         self.effects = pygame.sprite.Group()
         self.enemy_factory = EnemyFactory()
         self.bigger_enemy_factory = BiggerEnemyFactory()
 
         self.enemies = pygame.sprite.Group()
-        self.lasers = pygame.sprite.Group()
+        self.lasers = CenteredGroup()
+        # Plain lasers go in a projectile system when NumPy is available,
+        # everything else (e.g. SpreadLasers) is a sprite in ``lasers``
+        self.projectiles = None
+        if numpy is not None and config.get('array_projectiles', True):
+            self.projectiles = ProjectileSystem(load_image(Laser.image_file))
 
-        self.player = Player((SCREEN_WIDTH / 2, 650), self.sprites)
+        self.player = Player((SCREEN_WIDTH / 2, 650), self.sprites, controls=controls)
 
-        self.background_music = pygame.mixer.Sound(background_music)
-        # background_music = pygame.mixer.Sound('assets/sound/music/techno_gameplay_loop.ogg')
-        self.background_music.set_volume(0.9)
-        self.background_music.play(loops=-1, fade_ms=2000)
+        self.background_music = background_music
 
         self.enemy_cooldown = 4
         self.enemy_cooldown_state = 5  # initial time before enemies spawn
@@ -452,6 +1983,14 @@ class Level(object):
         self.is_ended = False  # Signal game loop to load a new level
         self.end_timer = 1  # seconds between complete and end
 
+    def start(self):
+        """
+        Called when the level becomes the active one. Anything with a
+        side effect (like music) goes here rather than in ``__init__``,
+        since levels may be built ahead of time.
+        """
+        music.play(self.background_music, fade_ms=2000)
+
     def update(self, dt, events):
         points = 0
         for event in events:
@@ -459,13 +1998,14 @@ class Level(object):
                 if event.key == pygame.K_F2:
                     self.background.toggle_starfield()
                 if event.key == pygame.K_MINUS:
-                    self.background_music.set_volume(self.background_music.get_volume() - 0.1)
+                    music.set_volume(music.get_volume() - 0.1)
                 if event.key == pygame.K_EQUALS:
-                    self.background_music.set_volume(self.background_music.get_volume() + 0.1)
+                    music.set_volume(music.get_volume() + 0.1)
 
         # Spawn Enemies
         if self.enemy_cooldown_state <= 0:
-            self.add_random_enemies()
+            with profiler.phase('update.spawn'):
+                self.add_random_enemies()
             self.enemy_cooldown_state = self.enemy_cooldown
         if self.enemy_cooldown_timer_state <= 0:
             self.enemy_cooldown_timer_state = self.enemy_cooldown_timer
@@ -474,13 +2014,23 @@ class Level(object):
         self.enemy_cooldown_state -= dt
         self.enemy_cooldown_timer_state -= dt
 
+        music.update(dt)
+
         # Sprite Updates
-        self.background.update(dt, self.player)
-        self.lasers.update(dt)
-        self.sprites.update(dt, self)
-        self.enemies.update(dt)
-        self.effects.update(dt)
-        self.score_display_group.update(dt)
+        with profiler.phase('update.background'):
+            self.background.update(dt, self.player)
+        with profiler.phase('update.lasers'):
+            self.lasers.update(dt)
+            if self.projectiles is not None:
+                self.projectiles.update(dt)
+        with profiler.phase('update.sprites'):
+            self.sprites.update(dt, self)
+        with profiler.phase('update.enemies'):
+            self.enemies.update(dt)
+        with profiler.phase('update.effects'):
+            self.effects.update(dt)
+        with profiler.phase('update.scores'):
+            self.score_display_group.update(dt)
 
         if self.is_complete:
             self.end_timer -= dt
@@ -489,11 +2039,19 @@ class Level(object):
             return points
 
         # Game Logic
-        hits = pygame.sprite.groupcollide(self.enemies, self.lasers, False, True)
-        for enemy, lasers in hits.items():
+        with profiler.phase('update.collisions'):
+            hits = sweep_groupcollide(self.enemies, self.lasers, False, True,
+                                      collided=self.collided)
+            impacts = {enemy: lasers[0].rect.midtop for enemy, lasers in hits.items()}
+            if self.projectiles is not None:
+                projectile_hits = self.projectiles.collide(self.enemies, masks=self.collided is not None)
+                for enemy, positions in projectile_hits.items():
+                    impacts.setdefault(enemy, positions[0])
+        max_effects = self.quality.max_effects
+        for enemy, position in impacts.items():
             # Hit effect
-            laser = lasers[0]
-            LaserHit(laser.rect.midtop, self.effects)
+            if max_effects is None or len(self.effects) < max_effects:
+                LaserHit.acquire(position, self.effects)
             is_destroyed = enemy.hit()
             if is_destroyed:
                 points += enemy.points
@@ -510,18 +2068,76 @@ class Level(object):
             self.end()
         return points
 
-    def draw(self, screen):
-        self.background.draw(screen)
-        self.enemies.draw(screen)
-        self.lasers.draw(screen)
-        self.sprites.draw(screen)
-        self.effects.draw(screen)
-        self.score_display_group.draw(screen)
-        self.display_cooldowns(screen)
+    def draw(self, screen, dirty=None, alpha=None):
+        """
+        If ``dirty`` is given, the screen regions that changed are added
+        to it, for use with ``DirtyRegions``.
+
+        If ``alpha`` is given, moving sprites are drawn that fraction of
+        the way between their previous and current positions.
+        """
+        moving = (self.enemies, self.lasers, self.sprites)
+        if alpha is not None:
+            for group in moving:
+                for sprite in group:
+                    sprite.interpolate(alpha)
+        with profiler.phase('draw.background'):
+            self.background.draw(screen, dirty)
+        groups = (
+            ('draw.enemies', self.enemies),
+            ('draw.lasers', self.lasers),
+            ('draw.sprites', self.sprites),
+            ('draw.effects', self.effects),
+        )
+        for name, group in groups:
+            with profiler.phase(name):
+                group.draw(screen)
+                if group is self.lasers and self.projectiles is not None:
+                    self.projectiles.draw(screen, alpha, dirty)
+            if dirty is not None:
+                # The rects each sprite was just blitted to
+                dirty.extend(group.spritedict.values())
+        if alpha is not None:
+            for group in moving:
+                for sprite in group:
+                    sprite.interpolate(1)
+        with profiler.phase('draw.scores'):
+            score_rects = self.score_display_group.draw(screen)
+        with profiler.phase('draw.cooldowns'):
+            cooldowns_changed = self.display_cooldowns(screen)
+        if dirty is not None:
+            dirty.extend(score_rects)
+            if cooldowns_changed:
+                dirty.append(self.cooldown_panel.surface.get_rect(topleft=self.cooldown_panel.topleft))
 
     def end(self):
-        self.enemies.empty()
-        self.background_music.fadeout(self.end_timer * 1000)
+        for enemy in self.enemies.sprites():
+            enemy.kill()
+        music.fadeout(self.end_timer * 1000)
+
+    def close(self):
+        """
+        Hands any remaining pooled sprites back, once the level is done.
+        """
+        for group in (self.enemies, self.lasers, self.effects):
+            for sprite in group.sprites():
+                sprite.kill()
+        if self.projectiles is not None:
+            self.projectiles.clear()
+
+    def set_quality(self, quality):
+        """
+        Applies a ``QualityTier``. Only affects how the level looks, never
+        how it plays.
+        """
+        self.quality = quality
+        self.background.set_quality(quality)
+
+    def fire_laser(self, midbottom):
+        if self.projectiles is not None:
+            self.projectiles.add(midbottom)
+        else:
+            Laser.acquire(midbottom, self.lasers)
 
     def add_random_enemies(self):
         if self.is_complete:
@@ -538,162 +2154,935 @@ class Level(object):
             self.bigger_enemy_factory.spawn(position, self.enemies, color=color,
                 dy=speed - 60)
 
-    def _display_ability(self, surface, ability):
-        BORDER = 2
-        ABILITY_COLOR = (200, 200, 200, 255)
-        label = self.ability_font.render(ability.label, True, ABILITY_COLOR)
-        surface.blit(label, (0, 0))
-        font_height = self.ability_font.get_height()
-        width = surface.get_width()
-        background_position = (0, font_height + 2)
-        background_height = surface.get_height() / 2
-        background = pygame.Rect(background_position, (width, background_height))
-        surface.fill(ABILITY_COLOR, background)
+    def display_cooldowns(self, screen):
+        return self.cooldown_panel.draw(screen, self.player.get_ability_states())
 
-        if ability.cooldown_state == 0:
-            return
 
-        # Display the cooldown by carving a transparant block out of the
-        # ability display background rectangle
-        empty_topleft = (background_position[0] + BORDER,
-                         background_position[1] + BORDER)
-        empty_height = background_height - (BORDER * 2)
-        # max_empty_width = width - (BORDER * 2)
-        empty_width = (width * ability.cooldown_state) / ability.cooldown
+class DirtyRegions(object):
+    """
+    Presents only the parts of the screen that changed, with
+    ``pygame.display.update``, instead of flipping the whole frame.
+
+    Each frame's changed rects are snapped to a grid of ``tile_size``
+    tiles, along with everything changed the frame before (so that
+    sprites which moved or disappeared get erased), and merged into as
+    few rects as possible. ``count`` and ``area`` describe the last
+    frame presented.
+    """
 
-        if empty_width < 1:
-            return
+    def __init__(self, bounds=SCREEN_RECT, tile_size=32):
+        self.bounds = pygame.rect.Rect(bounds)
+        self.tile_size = tile_size
+        self.columns = ceil(self.bounds.width / tile_size)
+        self.rows = ceil(self.bounds.height / tile_size)
+        self.previous = set()
+        self.count = 0
+        self.area = 0
 
-        empty = pygame.Rect(empty_topleft, (empty_width, empty_height))
-        surface_rect = surface.get_rect()
-        empty.right = surface_rect.right - BORDER
-        surface.fill((255, 255, 255, 255), empty, pygame.BLEND_RGBA_SUB)
+    def invalidate(self):
+        """
+        Forces the next frame to be presented in full.
+        """
+        self.previous = {(column, row) for column in range(self.columns) for row in range(self.rows)}
+
+    def _tiles(self, rects):
+        tiles = set()
+        size = self.tile_size
+        for rect in rects:
+            rect = self.bounds.clip(rect)
+            if not rect:
+                continue
+            for column in range(rect.left // size, (rect.right - 1) // size + 1):
+                for row in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                    tiles.add((column, row))
+        return tiles
 
-    def display_cooldowns(self, screen, *abilities):
+    def _merge(self, tiles):
+        """
+        Merges tiles into runs along each row, then merges runs that
+        line up in consecutive rows.
+        """
+        columns_by_row = {}
+        for column, row in tiles:
+            columns_by_row.setdefault(row, []).append(column)
+
+        size = self.tile_size
+        merged = []
+        growing = {}  # (start, length) -> rect still growing downwards
+        for row in range(self.rows):
+            runs = []
+            for column in sorted(columns_by_row.get(row, ())):
+                if runs and runs[-1][0] + runs[-1][1] == column:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([column, 1])
+            runs = [tuple(run) for run in runs]
+            for run in list(growing):
+                if run not in runs:
+                    merged.append(growing.pop(run))
+            for start, length in runs:
+                if (start, length) in growing:
+                    growing[(start, length)].height += size
+                else:
+                    growing[(start, length)] = pygame.rect.Rect(
+                        start * size, row * size, length * size, size)
+        merged.extend(growing.values())
+        return [self.bounds.clip(rect) for rect in merged]
+
+    def present(self, rects):
+        current = self._tiles(rects)
+        merged = self._merge(current | self.previous)
+        self.previous = current
+        self.count = len(merged)
+        self.area = sum(rect.width * rect.height for rect in merged)
+        if merged:
+            pygame.display.update(merged)
+
+    def coverage(self):
         """
-        Each ability requires the following properties:
+        Fraction of the screen presented in the last frame.
+        """
+        return self.area / (self.bounds.width * self.bounds.height)
+
+
+QualityTier = namedtuple('QualityTier', ['name', 'stars', 'max_effects', 'rotation_steps', 'parallax'])
+
+# From cheapest to best looking. ``stars`` is the fraction of the
+# starfield drawn, and ``max_effects`` caps live hit effects (None for no
+# limit).
+QUALITY_TIERS = [
+    QualityTier('Low', 0.25, 8, 16, False),
+    QualityTier('Medium', 0.5, 24, 32, True),
+    QualityTier('High', 1, None, 64, True),
+]
 
-        .cooldown: Cooldown time for the ability
-        .cooldown_state: Current time remaining before the ability is off cooldown
-        .label: Name of the ability
+
+class QualityGovernor(object):
+    """
+    Picks a quality tier from how long frames take to produce, against
+    the ``1 / FPS`` budget. Frame times are averaged over ``window``
+    frames; over ``step_down`` of the budget drops a tier, and under
+    ``step_up`` of it climbs back a tier. The window starts over after
+    each change, so the new tier gets a fair measurement.
+
+    Frame times should exclude the time ``Clock.tick`` spends waiting
+    (e.g. ``Clock.get_rawtime``), or every frame looks like it used the
+    whole budget.
+    """
+
+    def __init__(self, budget=1. / FPS, window=60, step_down=0.9, step_up=0.5, tiers=QUALITY_TIERS):
+        self.budget = budget
+        self.tiers = tiers
+        self.index = len(tiers) - 1
+        self.step_down = step_down
+        self.step_up = step_up
+        self.times = deque(maxlen=window)
+
+    @property
+    def tier(self):
+        return self.tiers[self.index]
+
+    def mean(self):
+        return sum(self.times) / len(self.times) if self.times else 0
+
+    def update(self, frame_time):
+        """
+        Adds a frame time, in seconds. Returns True if the tier changed.
+        """
+        self.times.append(frame_time)
+        if len(self.times) < self.times.maxlen:
+            return False
+        load = self.mean() / self.budget
+        if load > self.step_down and self.index > 0:
+            self.index -= 1
+        elif load < self.step_up and self.index < len(self.tiers) - 1:
+            self.index += 1
+        else:
+            return False
+        self.times.clear()
+        return True
+
+
+class StartupTimeline(object):
+    """
+    Records how long each stage of startup took, from the moment
+    ``main`` started importing.
+    """
+
+    def __init__(self, start=_import_started):
+        self.start = start
+        self.marks = []
+
+    def mark(self, label):
+        self.marks.append((label, perf_counter()))
+
+    def report(self):
+        lines = ['Startup timeline (ms)']
+        previous = self.start
+        for label, time in self.marks:
+            lines.append('  {:<12} {:8.1f}  (+{:.1f})'.format(
+                label, (time - self.start) * 1000, (time - previous) * 1000))
+            previous = time
+        return '\n'.join(lines)
+
+
+class LevelLoader(object):
+    """
+    Builds levels on a worker thread, one ahead of the level being
+    played, so the next level is ready by the time it's needed.
+
+    ``handoff_time`` is how long the last switch to a new level blocked
+    the game loop, in seconds.
+    """
+
+    def __init__(self, levels, threaded=True):
+        self.levels = levels
+        self.executor = ThreadPoolExecutor(max_workers=1) if threaded else None
+        self.future = None
+        self.handoff_time = 0
+        self.handoff_times = []
+        self._prefetch()
+
+    def _prefetch(self):
+        if self.executor is not None:
+            self.future = self.executor.submit(next, self.levels)
+
+    def next_level(self):
+        start = perf_counter()
+        if self.future is None:
+            level = next(self.levels)
+        else:
+            level = self.future.result()
+        level.start()
+        self.handoff_time = perf_counter() - start
+        self.handoff_times.append(self.handoff_time)
+        self._prefetch()
+        return level
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+SnapshotHeader = namedtuple('SnapshotHeader', [
+    'magic', 'version',
+    # Game
+    'steps', 'player_score', 'level_number', 'accumulator',
+    # Level
+    'enemy_cooldown', 'enemy_cooldown_state', 'enemy_cooldown_timer', 'enemy_cooldown_timer_state',
+    'score', 'player_powerup', 'is_complete', 'is_ended', 'end_timer',
+    # Player
+    'x', 'y', 'previous_x', 'previous_y', 'dx', 'dy', 'level', 'laser_1_cooldown',
+    'laser_1_cooldown_state', 'burst_cooldown_state', 'q_cooldown_state',
+    # Whether plain lasers are in a ProjectileSystem, then array lengths
+    'array_projectiles', 'enemies', 'lasers', 'projectiles', 'effects', 'scores', 'score_text_size',
+])
+SNAPSHOT_HEADER = struct.Struct('<4sB' 'QqId' 'ddddqq??d' 'ddddddBdddd' '?IIIIII')
+SNAPSHOT_MAGIC = b'ASKS'
+SNAPSHOT_VERSION = 2
+ENEMY_COLORS = sorted(EnemyFactory.image_files)
+
+
+class _SnapshotReader(object):
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def array(self, typecode, count):
+        values = array(typecode)
+        end = self.offset + count * values.itemsize
+        values.frombytes(self.data[self.offset:end])
+        self.offset = end
+        return values
+
+    def bytes(self, count):
+        self.offset += count
+        return self.data[self.offset - count:self.offset]
+
+
+def _pack_rng(generator):
+    version, state, gauss = generator.getstate()
+    return array('I', state).tobytes() + array('d', [float('nan') if gauss is None else gauss]).tobytes()
+
+
+def _unpack_rng(generator, reader):
+    state = tuple(reader.array('I', 625))
+    gauss = reader.array('d', 1)[0]
+    generator.setstate((3, state, None if gauss != gauss else gauss))
+
+
+def write_snapshot(game):
+    """
+    Serializes the state of a running game. Scalars go in a fixed size
+    header, and each kind of sprite is stored as flat arrays of its
+    fields, followed by the state of both random number generators.
+
+    Anything that can be rebuilt is left out: level configs (levels are
+    rebuilt from their number), images, sounds, and cosmetic state like
+    the starfield and background parallax.
+    """
+    level = game.level
+    player = level.player
+    image_colors = {}
+    factories = [level.enemy_factory]
+    # Bigger enemy images load on demand; if they haven't yet, there are
+    # no bigger enemies to look up, so leave them be
+    if level.bigger_enemy_factory.loaded:
+        factories.append(level.bigger_enemy_factory)
+    for factory in factories:
+        for color, image in factory.images.items():
+            image_colors[image] = ENEMY_COLORS.index(color)
+
+    enemies = level.enemies.sprites()
+    enemy_kinds = array('B', [isinstance(enemy, BiggerEnemy) for enemy in enemies])
+    enemy_colors = array('B', [image_colors[enemy.image] for enemy in enemies])
+    enemy_hp = array('h', [enemy.hp for enemy in enemies])
+    enemy_values = array('d')
+    for enemy in enemies:
+        enemy_values.extend(enemy.center + enemy.previous_center + (enemy.dy,))
+
+    lasers = level.lasers.sprites()
+    laser_steps = array('H', [laser.atlas.steps if isinstance(laser, SpreadLaser) else 0 for laser in lasers])
+    laser_values = array('d')
+    for laser in lasers:
+        laser_values.extend(laser.center + laser.previous_center
+                            + (laser.dx, laser.dy, getattr(laser, 'angle', 0)))
+
+    projectiles = level.projectiles
+    projectile_bytes = b''
+    if projectiles is not None:
+        projectile_bytes = b''.join(getattr(projectiles, field)[:projectiles.count].tobytes()
+                                    for field in projectiles.fields)
+
+    effects = level.effects.sprites()
+    effect_rotations = array('H', [effect.rotation for effect in effects])
+    effect_values = array('d')
+    for effect in effects:
+        effect_values.extend(effect.rect.center + (effect.lifespan,))
+
+    scores = level.score_display_group.scores
+    score_values = array('d')
+    for score in scores:
+        score_values.extend(tuple(score.position) + (score.ttl,))
+    score_text = '\n'.join(score.text for score in scores).encode('utf-8')
+
+    header = SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+        game.steps, game.player_score, game.level_number, game.accumulator,
+        level.enemy_cooldown, level.enemy_cooldown_state, level.enemy_cooldown_timer,
+        level.enemy_cooldown_timer_state, level.score, level.player_powerup, level.is_complete,
+        level.is_ended, level.end_timer,
+        player.center[0], player.center[1], player.previous_center[0], player.previous_center[1],
+        player.dx, player.dy, player.level, player.laser_1_cooldown, player.laser_1_cooldown_state,
+        player.burst_cooldown_state, player.q_cooldown_state,
+        projectiles is not None, len(enemies), len(lasers), 0 if projectiles is None else projectiles.count, len(effects),
+        len(scores), len(score_text),
+    )
+    return b''.join([
+        header, enemy_kinds.tobytes(), enemy_colors.tobytes(), enemy_hp.tobytes(), enemy_values.tobytes(),
+        laser_steps.tobytes(), laser_values.tobytes(), projectile_bytes,
+        effect_rotations.tobytes(), effect_values.tobytes(), score_values.tobytes(), score_text,
+        _pack_rng(rng), _pack_rng(effect_rng),
+    ])
+
+
+def read_snapshot(game, data):
+    """
+    Restores a running game to the state in ``data``, from
+    ``write_snapshot``. The current level is reused if the snapshot is
+    from the same level, otherwise the snapshot's level is rebuilt.
+    """
+    header = SnapshotHeader._make(SNAPSHOT_HEADER.unpack_from(data))
+    if header.magic != SNAPSHOT_MAGIC or header.version != SNAPSHOT_VERSION:
+        raise ValueError('Not an AstroSky snapshot')
+    if header.array_projectiles != (game.level.projectiles is not None):
+        # The rest of the stream would be read misaligned
+        raise ValueError('Snapshot was taken with array projectiles {}'.format(
+            'on' if header.array_projectiles else 'off'))
+    reader = _SnapshotReader(data, SNAPSHOT_HEADER.size)
+
+    game.level.close()
+    if header.level_number != game.level_number:
+        game.loader.close()
+        game.loader = LevelLoader(game.load_levels(header.level_number), threaded=game.preload)
+        game.level = game.loader.next_level()
+    game.steps = header.steps
+    game.player_score = header.player_score
+    game.level_number = header.level_number
+    game.accumulator = header.accumulator
+
+    level = game.level
+    for name in ('enemy_cooldown', 'enemy_cooldown_state', 'enemy_cooldown_timer', 'enemy_cooldown_timer_state',
+                 'score', 'player_powerup', 'is_complete', 'is_ended', 'end_timer'):
+        setattr(level, name, getattr(header, name))
+
+    player = level.player
+    player.place((header.x, header.y), (header.previous_x, header.previous_y))
+    for name in ('dx', 'dy', 'level', 'laser_1_cooldown', 'laser_1_cooldown_state',
+                 'burst_cooldown_state', 'q_cooldown_state'):
+        setattr(player, name, getattr(header, name))
+
+    enemy_kinds = reader.array('B', header.enemies)
+    enemy_colors = reader.array('B', header.enemies)
+    enemy_hp = reader.array('h', header.enemies)
+    enemy_values = reader.array('d', header.enemies * 5)
+    for index, (kind, color, hp) in enumerate(zip(enemy_kinds, enemy_colors, enemy_hp)):
+        x, y, previous_x, previous_y, dy = enemy_values[index * 5:index * 5 + 5]
+        if kind:
+            image, cls = level.bigger_enemy_factory.images[ENEMY_COLORS[color]], BiggerEnemy
+        else:
+            image, cls = level.enemy_factory.images[ENEMY_COLORS[color]], Enemy
+        enemy = cls.acquire(image, (0, 0), level.enemies, dy=dy)
+        enemy.place((x, y), (previous_x, previous_y))
+        enemy.hp = hp
+
+    laser_steps = reader.array('H', header.lasers)
+    laser_values = reader.array('d', header.lasers * 7)
+    for index, steps in enumerate(laser_steps):
+        x, y, previous_x, previous_y, dx, dy, angle = laser_values[index * 7:index * 7 + 7]
+        if steps:
+            laser = SpreadLaser.acquire((0, 0), level.lasers, dx=dx, dy=dy, steps=steps)
+            laser.angle = angle
+            laser.image, laser.offset = laser.atlas.frame(angle)
+        else:
+            laser = Laser.acquire((0, 0), level.lasers, dx=dx, dy=dy)
+        laser.place((x, y), (previous_x, previous_y))
+
+    if level.projectiles is not None:
+        projectiles = level.projectiles
+        while len(projectiles.x) < header.projectiles:
+            projectiles._grow()
+        for field in projectiles.fields:
+            getattr(projectiles, field)[:header.projectiles] = reader.array('d', header.projectiles)
+        projectiles.count = header.projectiles
+
+    effect_rotations = reader.array('H', header.effects)
+    effect_values = reader.array('d', header.effects * 3)
+    for index, rotation in enumerate(effect_rotations):
+        x, y, lifespan = effect_values[index * 3:index * 3 + 3]
+        effect = LaserHit.acquire((x, y), level.effects)
+        effect.rotation, effect.lifespan = rotation, lifespan
+        effect.update(0)
+
+    score_values = reader.array('d', header.scores * 3)
+    score_text = reader.bytes(header.score_text_size).decode('utf-8').split('\n')
+    level.score_display_group.scores = [
+        ScoreDisplay(text, (int(score_values[index * 3]), int(score_values[index * 3 + 1])),
+                     score_values[index * 3 + 2])
+        for index, text in enumerate(score_text[:header.scores])
+    ]
+
+    # Last, since acquiring effects draws from ``effect_rng``
+    _unpack_rng(rng, reader)
+    _unpack_rng(effect_rng, reader)
+
+
+class SnapshotBuffer(object):
+    """
+    Ring buffer of recent snapshots, as ``(step, data)`` pairs, holding
+    at most ``budget`` bytes. The oldest snapshots are dropped first.
+    """
+
+    def __init__(self, budget=8 * 1024 * 1024):
+        self.budget = budget
+        self.snapshots = deque()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def add(self, step, data):
+        if self.snapshots and step <= self.snapshots[-1][0]:
+            # Already have this far, e.g. replaying forward after a seek
+            return
+        self.snapshots.append((step, data))
+        self.bytes += len(data)
+        while self.bytes > self.budget and len(self.snapshots) > 1:
+            self.bytes -= len(self.snapshots.popleft()[1])
+
+    def latest(self):
+        return self.snapshots[-1] if self.snapshots else None
+
+    def before(self, step):
+        """
+        Returns the newest snapshot taken at or before ``step``, or None.
         """
-        DISPLAY_HEIGHT = 40
-        BACKGROUND_COLOR = (100, 100, 100, 60)
-        DISPLAY_TOPLEFT = (0, SCREEN_HEIGHT - DISPLAY_HEIGHT)
-        background = pygame.Surface((SCREEN_WIDTH, DISPLAY_HEIGHT), pygame.SRCALPHA)
-        background.fill(BACKGROUND_COLOR)
-        MARGIN = 10
+        for entry in reversed(self.snapshots):
+            if entry[0] <= step:
+                return entry
+        return None
 
-        ability_states = self.player.get_ability_states()
-        ABILITY_WIDTH = 140
-        x = MARGIN
+    def clear(self):
+        self.snapshots.clear()
+        self.bytes = 0
 
-        for ability in ability_states:
-            s = pygame.Surface((ABILITY_WIDTH, DISPLAY_HEIGHT - MARGIN), pygame.SRCALPHA)
-            self._display_ability(s, ability)
-            background.blit(s, (x, 2))
-            x = x + ABILITY_WIDTH + MARGIN
-        screen.blit(background, DISPLAY_TOPLEFT)
+    def truncate(self, step):
+        """
+        Drops every snapshot taken after ``step``, e.g. after rewinding.
+        """
+        while self.snapshots and self.snapshots[-1][0] > step:
+            self.bytes -= len(self.snapshots.pop()[1])
 
 
 class Game(object):
-    def load_levels(self):
-        # Right now this is hard-coded, but it could be loaded from a
-        # config file
-        configs = [
-            {
-                'background_music': 'assets/sound/music/DigitalNativeLooped.ogg',
-                'background_image': 'assets/art/spacefield1600x1000.png',
-                'enemy_colors': ['green'],
-                'end_score': 10000,
-            },
-            {
-                'background_music': 'assets/sound/music/techno_gameplay_loop.ogg',
-                'background_image': 'assets/art/spacefield1600x1000.png',
-                'enemy_colors': ['green', 'blue'],
-                'end_score': 20000,
-            },
-            {
-                'background_music': 'assets/sound/music/techno_gameplay_loop.ogg',
-                'background_image': 'assets/art/spacefield1600x1000.png',
-                'enemy_colors': ['blue', 'black'],
-                'end_score': 30000,
-            },
-            {
-                'background_music': 'assets/sound/music/techno_gameplay_loop.ogg',
-                'background_image': 'assets/art/spacefield1600x1000.png',
-                'enemy_colors': ['blue', 'black', 'red'],
-                'end_score': 40000,
-            },
-        ]
-        for config in configs:
-            yield Level(**config)
-        # Keep playing the last level
+    # Right now this is hard-coded, but it could be loaded from a config
+    # file
+    level_configs = [
+        {
+            'background_music': 'assets/sound/music/DigitalNativeLooped.ogg',
+            'background_image': 'assets/art/spacefield1600x1000.png',
+            'enemy_colors': ['green'],
+            'end_score': 10000,
+        },
+        {
+            'background_music': 'assets/sound/music/techno_gameplay_loop.ogg',
+            'background_image': 'assets/art/spacefield1600x1000.png',
+            'enemy_colors': ['green', 'blue'],
+            'end_score': 20000,
+        },
+        {
+            'background_music': 'assets/sound/music/techno_gameplay_loop.ogg',
+            'background_image': 'assets/art/spacefield1600x1000.png',
+            'enemy_colors': ['blue', 'black'],
+            'end_score': 30000,
+        },
+        {
+            'background_music': 'assets/sound/music/techno_gameplay_loop.ogg',
+            'background_image': 'assets/art/spacefield1600x1000.png',
+            'enemy_colors': ['blue', 'black', 'red'],
+            'end_score': 40000,
+        },
+    ]
+
+    def __init__(self, controls=None, seed=None, preload=True, dirty_rects=False,
+                 fixed_step=None, max_steps=5, record=False, timeline=None, quality=None,
+                 snapshot_interval=None, snapshot_budget=8 * 1024 * 1024, resume=None):
+        self.controls = controls
+        self.timeline = timeline
+        # A fixed QualityTier, or None to adjust quality to the frame rate
+        # while running
+        self.quality = quality
+        self.governor = None
+        self.recorder = None
+        if record:
+            # A recording is only reproducible from a known seed
+            if seed is None:
+                seed = Random().getrandbits(32)
+            self.recorder = InputRecorder(controls or KeyboardInput(), seed)
+            self.controls = self.recorder
+        # Seeds the gameplay RNG on every start(), so restarting replays
+        # the same game. None leaves it unseeded.
+        self.seed = seed
+        self.preload = preload
+        self.dirty_regions = DirtyRegions() if dirty_rects else None
+        # Simulation step in seconds, or None to step once per frame
+        self.fixed_step = fixed_step
+        # Most simulation steps to run for a single rendered frame
+        self.max_steps = max_steps
+        self.accumulator = 0
+        self.pending_events = []
+        self.player_score = 0
+        self.loader = None
+        self.level = None
+        self.steps = 0
+        self.level_number = 0
+        # Steps between snapshots kept for rewinding, or None for none
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = SnapshotBuffer(snapshot_budget) if snapshot_interval else None
+        # Snapshot to pick up from, instead of starting a new game
+        self.resume = resume
+
+    def load_levels(self, start=0):
+        configs = self.level_configs
+        number = start
         while True:
-            yield Level(**configs[-1])
+            # Keep playing the last level
+            yield Level(controls=self.controls, **configs[min(number, len(configs) - 1)])
+            number += 1
+
+    def start(self):
+        if self.seed is not None:
+            rng.seed(self.seed)
+        self.player_score = 0
+        self.accumulator = 0
+        self.pending_events = []
+        self.steps = 0
+        self.level_number = 0
+        self.loader = LevelLoader(self.load_levels(), threaded=self.preload)
+        self.level = self.loader.next_level()
+        if self.resume is not None:
+            self.restore(self.resume)
+        self.apply_quality()
+
+    def stop(self):
+        if self.snapshots is not None:
+            self.snapshots.add(self.steps, self.snapshot())
+        self.level.close()
+        self.loader.close()
+
+    def snapshot(self):
+        return write_snapshot(self)
+
+    def restore(self, data):
+        read_snapshot(self, data)
+        self.apply_quality()
+        if self.dirty_regions is not None:
+            self.dirty_regions.invalidate()
+        # Scripted and replayed input has to pick up from the same step
+        seek = getattr(self.controls, 'seek', None)
+        if seek is not None:
+            seek(self.steps)
+
+    def rewind(self, steps):
+        """
+        Goes back to the newest snapshot from at least ``steps`` steps
+        ago, or the oldest one kept. Returns False if there isn't one.
+        """
+        if not self.snapshots:
+            return False
+        step, data = self.snapshots.before(self.steps - steps) or self.snapshots.snapshots[0]
+        self.restore(data)
+        self.snapshots.truncate(step)
+        return True
+
+    def update(self, dt, events):
+        if self.recorder is not None:
+            self.recorder.step(dt)
+        points = self.level.update(dt, events)
+        if points:
+            self.player_score += points
+        if self.level.is_ended:
+            self.level.close()
+            self.level = self.loader.next_level()
+            self.level_number += 1
+            self.apply_quality()
+        self.steps += 1
+        if self.snapshots is not None and self.steps % self.snapshot_interval == 0:
+            self.snapshots.add(self.steps, self.snapshot())
+
+    def apply_quality(self):
+        if self.governor is not None:
+            self.level.set_quality(self.governor.tier)
+        elif self.quality is not None:
+            self.level.set_quality(self.quality)
+
+    def advance(self, dt, events):
+        """
+        Runs the simulation for a frame that took ``dt`` seconds. Returns
+        the interpolation factor to draw with, or None when the game
+        isn't using a fixed step.
+
+        With a fixed step, the frame time is banked, and spent in whole
+        steps of ``fixed_step`` seconds, so a slow frame runs several
+        steps and a fast one may run none. If the simulation falls more
+        than ``max_steps`` behind, the backlog is dropped rather than
+        letting the game spiral.
+        """
+        if self.fixed_step is None:
+            self.update(dt, events)
+            return None
+
+        self.accumulator += dt
+        self.pending_events.extend(events)
+        steps = 0
+        while self.accumulator >= self.fixed_step and steps < self.max_steps:
+            self.update(self.fixed_step, self.pending_events)
+            self.pending_events = []
+            self.accumulator -= self.fixed_step
+            steps += 1
+        if steps == self.max_steps:
+            self.accumulator = min(self.accumulator, self.fixed_step)
+        return self.accumulator / self.fixed_step
+
+    def simulate(self, frames, dt=1. / FPS):
+        """
+        Steps the game ``frames`` times as fast as possible, without
+        drawing or waiting on the frame clock. Returns the player score.
+        """
+        if self.level is None:
+            self.start()
+        for _ in range(frames):
+            profiler.begin_frame()
+            with profiler.phase('update'):
+                self.update(dt, [])
+            profiler.end_frame()
+        return self.player_score
 
     def run(self, screen):
         stats = False
         clock = pygame.time.Clock()
-        font = pygame.font.Font('assets/fonts/ShareTechMono-Regular.ttf', 16, bold=True)
-        score_font = pygame.font.Font('assets/ssr/Bonus/kenvector_future.ttf', 25)
+        font = load_font('assets/fonts/ShareTechMono-Regular.ttf', 16)
+        font.set_bold(True)
+        score_font = load_font('assets/ssr/Bonus/kenvector_future.ttf', 25)
         paused = False
+        if self.quality is None:
+            self.governor = QualityGovernor()
 
-        player_score = 0
-
-        levels = self.load_levels()
-
-        level = next(levels)
+        self.start()
+        if self.timeline is not None:
+            self.timeline.mark('first level')
 
         while True:
             dt = clock.tick(FPS) / 1000.
+            if self.governor is not None and self.governor.update(clock.get_rawtime() / 1000.):
+                self.apply_quality()
+            profiler.begin_frame()
             events = pygame.event.get()
             for event in events:
                 if event.type == pygame.QUIT:
+                    self.stop()
                     return
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE:
+                        self.stop()
                         return
                     if event.key == pygame.K_F1:
                         stats = not stats
+                    if event.key == pygame.K_F3:
+                        profiler.enabled = not profiler.enabled
                     if event.key == pygame.K_p:
                         paused = not paused
+                    if event.key == pygame.K_BACKSPACE and self.recorder is None:
+                        # Rewind a couple of seconds
+                        self.rewind(2 * FPS)
 
             if paused:
                 continue
 
-            points = level.update(dt, events)
-            if points:
-                player_score += points
-            if level.is_ended:
-                level = next(levels)
+            with profiler.phase('update'):
+                alpha = self.advance(dt, events)
+            level = self.level
 
-            level.draw(screen)
+            dirty = None if self.dirty_regions is None else []
+            with profiler.phase('draw'):
+                level.draw(screen, dirty, alpha)
 
             # Display
-            score_display = score_font.render('{:,}'.format(player_score), True, (200, 200, 200))
-            display_width = score_display.get_width()
-            display_x = SCREEN_WIDTH - 10 - display_width
-            screen.blit(score_display, (display_x, 10))
-
-            if stats:
-                lines = [
-                    "FPS {:.0f}".format(clock.get_fps()),
-                    "Player dx={:+} dy={:+}".format(level.player.dx, level.player.dy),
-                    "Laser Atk Speed {:.3f}".format(level.player.laser_1_cooldown),
-                    "Wave Spawn Interval {:.3f}".format(level.enemy_cooldown),
-                ]
-                pixel_offset = 10
-                for line in lines:
-                    surface = font.render(line, True, (200, 200, 200))
-                    screen.blit(surface, (10, pixel_offset))
-                    pixel_offset += 20
-            pygame.display.flip()
+            with profiler.phase('hud'):
+                score_display = text_cache.render(score_font, '{:,}'.format(self.player_score), True, (200, 200, 200))
+                display_width = score_display.get_width()
+                display_x = SCREEN_WIDTH - 10 - display_width
+                hud_rects = [screen.blit(score_display, (display_x, 10))]
+
+                if stats:
+                    lines = [
+                        "FPS {:.0f}".format(clock.get_fps()),
+                        "Player dx={:+} dy={:+}".format(level.player.dx, level.player.dy),
+                        "Laser Atk Speed {:.3f}".format(level.player.laser_1_cooldown),
+                        "Wave Spawn Interval {:.3f}".format(level.enemy_cooldown),
+                        "Sound Cache hits={} misses={}".format(*sound_cache_info()),
+                        "Voices played={} stolen={} dropped={}".format(*channel_manager.info()),
+                        "Level Handoff {:.1f}ms".format(self.loader.handoff_time * 1000),
+                        "Text Cache hit rate {:.0%}".format(text_cache.hit_rate()),
+                        "Images {:.1f}/{:.0f}MB evicted={}".format(
+                            image_cache.bytes / 2 ** 20, image_cache.budget / 2 ** 20, image_cache.evictions),
+                        "Sprites live={} pooled={}".format(*pool_info()),
+                    ]
+                    latency = channel_manager.latency()
+                    if latency is not None:
+                        lines.append("Audio Latency {:.1f}ms".format(latency * 1000))
+                    quality = "Quality {}".format(level.quality.name)
+                    if self.governor is not None:
+                        quality += " (auto, {:.1f}/{:.1f}ms)".format(
+                            self.governor.mean() * 1000, self.governor.budget * 1000)
+                    lines.append(quality)
+                    if self.dirty_regions is not None:
+                        lines.append("Dirty Rects {} ({:.0%})".format(
+                            self.dirty_regions.count, self.dirty_regions.coverage()))
+                    if profiler.enabled:
+                        lines.append("{:<18} {:>6} {:>6} {:>6}".format('Phase (ms)', 'p50', 'p95', 'p99'))
+                        lines.extend(profiler.report_lines())
+                    pixel_offset = 10
+                    for line in lines:
+                        surface = text_cache.render(font, line, True, (200, 200, 200))
+                        hud_rects.append(screen.blit(surface, (10, pixel_offset)))
+                        pixel_offset += 20
+
+            with profiler.phase('present'):
+                if dirty is None:
+                    pygame.display.flip()
+                else:
+                    self.dirty_regions.present(dirty + hud_rects)
+            profiler.end_frame()
+
+            if self.timeline is not None:
+                self.timeline.mark('first flip')
+                print(self.timeline.report())
+                self.timeline = None
+
+
+def run_replay(replay, screen=None, start=0):
+    """
+    Plays a recording back as fast as possible, drawing each frame too if
+    given a ``screen``. Returns the final score and frame time stats, in
+    seconds. With a ``start`` step, the game is first moved there with
+    ``seek_replay``, and only the frames after it are timed.
+    """
+    game = Game(controls=replay.controls(), seed=replay.seed, preload=False)
+    game.start()
+    seek_replay(game, replay, start)
+    times = []
+    for dt in replay.dts[start:]:
+        start = perf_counter()
+        game.update(dt, [])
+        if screen is not None:
+            game.level.draw(screen)
+        times.append(perf_counter() - start)
+    game.stop()
+    return game.player_score, frame_time_stats(times)
+
+
+def seek_replay(game, replay, step):
+    """
+    Moves a game playing ``replay`` to just before its ``step``th
+    update, by restoring the newest snapshot from before then and
+    simulating the rest. Seeking forward from past that snapshot just
+    simulates on from where the game is, and with no such snapshot the
+    game starts over, so it must have been made with the replay's seed.
+    """
+    snapshot = game.snapshots.before(step) if game.snapshots is not None else None
+    if snapshot is not None and game.level is not None and snapshot[0] <= game.steps <= step:
+        # Already between the snapshot and ``step``, so just play on
+        snapshot = None
+    if snapshot is not None:
+        game.restore(snapshot[1])
+    elif game.steps > step or game.level is None:
+        if game.level is not None:
+            game.level.close()
+            game.loader.close()
+        if game.snapshots is not None:
+            game.snapshots.clear()
+        game.start()
+        game.controls.seek(0)
+    for dt in replay.dts[game.steps:step]:
+        game.update(dt, [])
+
+
+def init_headless():
+    """
+    Initializes just enough of pygame to run the simulation without a
+    display or sound device. The mixer is left uninitialized, so every
+    sound loads as a ``NullSound``.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.display.init()
+    pygame.font.init()
+    # Images are converted to the display format, so we still need a
+    # (dummy) display surface.
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    load_bundle()
+    return screen
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='AstroSky')
+    parser.add_argument('--headless', action='store_true',
+                        help='Run the simulation without a display or sound')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for the gameplay random number generator')
+    parser.add_argument('--frames', type=int, default=60 * FPS,
+                        help='Number of frames to simulate when headless')
+    parser.add_argument('--player', choices=['bot', 'idle'], default='bot',
+                        help='Who plays when headless: BotInput, or nobody (an idle smoke run)')
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help='Only present the parts of the screen that changed')
+    parser.add_argument('--fixed-step', type=int, default=None, metavar='HZ',
+                        help='Run the simulation at a fixed rate, independent of rendering')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each phase of the frame (shown in the F1 overlay, toggle with F3)')
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help='Write frame timings to PATH on exit (.csv, otherwise Chrome trace JSON)')
+    parser.add_argument('--record', default=None, metavar='PATH',
+                        help='Record input and the RNG seed to PATH, for replaying later')
+    parser.add_argument('--replay', default=None, metavar='PATH',
+                        help='Replay a recording headless, as fast as possible, and report frame times')
+    parser.add_argument('--render', action='store_true',
+                        help='Include drawing in --replay frame times')
+    parser.add_argument('--seek', type=int, default=0, metavar='STEP',
+                        help='Start --replay frame times from STEP, jumping there without timing it')
+    parser.add_argument('--startup-timeline', action='store_true',
+                        help='Print how long each stage of startup took')
+    parser.add_argument('--audio-rate', type=int, default=44100, metavar='HZ',
+                        help='Mixer sample rate')
+    parser.add_argument('--audio-buffer', type=int, default=512, metavar='SAMPLES',
+                        help='Mixer buffer size; smaller is lower latency')
+    parser.add_argument('--image-budget', type=int, default=64, metavar='MB',
+                        help='Most memory to keep cached images in')
+    parser.add_argument('--quality', choices=['auto'] + [tier.name.lower() for tier in QUALITY_TIERS],
+                        default='auto', help='Graphics quality (default: adjust to the frame rate)')
+    parser.add_argument('--resume', default=None, metavar='PATH',
+                        help='Pick up from the game saved in PATH, if any, and save to it on exit')
+    parser.add_argument('--snapshot-budget', type=int, default=8, metavar='MB',
+                        help='Most memory to keep rewind snapshots in')
+    args = parser.parse_args(argv)
+    if args.resume and args.record:
+        # A recording replays from its seed, not from a resumed game
+        parser.error('--record cannot be combined with --resume')
+    return args
 
 
 if __name__ == '__main__':
-    pygame.mixer.pre_init(buffer=1024)
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-    game = Game()
-    game.run(screen)
+    timeline = StartupTimeline()
+    timeline.mark('import')
+    args = parse_args()
+    profiler.enabled = args.profile or bool(args.trace)
+    profiler.tracing = bool(args.trace)
+    image_cache.set_budget(args.image_budget * 1024 * 1024)
+    if args.replay:
+        screen = init_headless()
+        score, stats = run_replay(Replay.load(args.replay), screen if args.render else None, args.seek)
+        print('Replayed {} frames from step {} in {:.2f}s, score {:,}'.format(
+            stats.frames, args.seek, stats.total, score))
+        print('Frame time (ms) mean {:.3f} p50 {:.3f} p95 {:.3f} p99 {:.3f} max {:.3f}'.format(
+            *(value * 1000 for value in stats[2:])))
+    elif args.headless:
+        init_headless()
+        controls = BotInput(seed=args.seed) if args.player == 'bot' else ScriptedInput()
+        game = Game(controls=controls, seed=args.seed, record=bool(args.record))
+        if args.player == 'bot':
+            controls.game = game
+        score = game.simulate(args.frames)
+        game.stop()
+        if args.record:
+            game.recorder.save(args.record)
+        print('Simulated {} frames, score {:,}'.format(args.frames, score))
+        if profiler.enabled:
+            print("{:<18} {:>6} {:>6} {:>6}".format('Phase (ms)', 'p50', 'p95', 'p99'))
+            print('\n'.join(profiler.report_lines()))
+    else:
+        # Only start the subsystems the game uses, rather than everything
+        # pygame.init() would (joysticks, etc.)
+        pygame.display.init()
+        pygame.font.init()
+        init_audio(args.audio_rate, args.audio_buffer)
+        timeline.mark('pygame init')
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption('AstroSky')
+        timeline.mark('display')
+        load_bundle()
+        preload_sounds()
+        timeline.mark('assets')
+        fixed_step = 1. / args.fixed_step if args.fixed_step else None
+        quality = {tier.name.lower(): tier for tier in QUALITY_TIERS}.get(args.quality)
+        resume = None
+        if args.resume and os.path.exists(args.resume):
+            with open(args.resume, 'rb') as resume_file:
+                resume = resume_file.read()
+        # A snapshot every quarter second, for rewinding (backspace)
+        game = Game(seed=args.seed, dirty_rects=args.dirty_rects, fixed_step=fixed_step,
+                    record=bool(args.record), quality=quality,
+                    timeline=timeline if args.startup_timeline else None,
+                    snapshot_interval=FPS // 4, snapshot_budget=args.snapshot_budget * 1024 * 1024,
+                    resume=resume)
+        try:
+            game.run(screen)
+        finally:
+            # Save on the way out, even if the game crashed, so it can be
+            # resumed from the last snapshot
+            if args.resume and game.snapshots:
+                with open(args.resume, 'wb') as resume_file:
+                    resume_file.write(game.snapshots.latest()[1])
+        if args.record:
+            game.recorder.save(args.record)
+    if args.trace:
+        profiler.write_trace(args.trace)
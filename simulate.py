@@ -0,0 +1,154 @@
+"""
+Plays many seeded games headless, in parallel, with a bot player, and
+reports how each level plays out, e.g.:
+
+    python simulate.py --sessions 1000 --levels 2
+
+Each session is one game, played by ``main.BotInput`` until it finishes
+``--levels`` levels or runs out of ``--max-time`` simulated seconds. The
+report gives the score, time to complete and per-frame update cost for
+each level, across every session that reached it. Sessions run one
+process per core; use a coarser ``--dt`` to trade accuracy for speed.
+"""
+import argparse
+import json
+import os
+from collections import namedtuple
+from multiprocessing import Pool
+from time import perf_counter
+
+import main
+
+LevelResult = namedtuple('LevelResult', ['level', 'completed', 'score', 'time', 'frames', 'frame_cost'])
+LevelSummary = namedtuple('LevelSummary', ['level', 'sessions', 'completed', 'score_p50', 'time_p50',
+                                           'time_p95', 'frame_mean', 'session_p99_p95'])
+
+
+def init_worker():
+    # SDL traps SIGTERM by default, which stops the pool from shutting
+    # its workers down
+    os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+    main.init_headless()
+
+
+def play_session(seed, levels=4, max_time=900, dt=1. / main.FPS, skill=1.0):
+    """
+    Plays one game, and returns a ``LevelResult`` for each level reached.
+    ``frame_cost`` is the per-frame update time, in seconds.
+    """
+    bot = main.BotInput(skill=skill, seed=seed)
+    game = main.Game(controls=bot, seed=seed, preload=False)
+    bot.game = game
+    game.start()
+    results = []
+    level = game.level
+    elapsed = 0
+    times = []
+    while len(results) < levels and elapsed < max_time:
+        start = perf_counter()
+        game.update(dt, [])
+        times.append(perf_counter() - start)
+        elapsed += dt
+        if game.level is not level:
+            results.append(LevelResult(len(results) + 1, True, level.score, len(times) * dt,
+                                       len(times), main.frame_time_stats(times)))
+            level = game.level
+            times = []
+    if times and len(results) < levels:
+        results.append(LevelResult(len(results) + 1, False, level.score, len(times) * dt,
+                                   len(times), main.frame_time_stats(times)))
+    game.stop()
+    return results
+
+
+def _play(args):
+    return play_session(*args)
+
+
+def run_sessions(sessions, seed=0, processes=None, **options):
+    """
+    Plays ``sessions`` games with consecutive seeds, one process per
+    core, and returns each session's results in seed order.
+    """
+    processes = processes or os.cpu_count()
+    tasks = [(seed + index, options['levels'], options['max_time'], options['dt'], options['skill'])
+             for index in range(sessions)]
+    with Pool(processes, initializer=init_worker) as pool:
+        return pool.map(_play, tasks, chunksize=max(1, sessions // (4 * processes)))
+
+
+def summarize(results):
+    """
+    Aggregates session results into a ``LevelSummary`` per level. Times
+    are in simulated seconds, frame costs in seconds. ``session_p99_p95``
+    is the 95th percentile, across sessions, of each session's p99
+    frame, rather than a p99 of every frame (which would mean shipping
+    every frame time back from the workers).
+    """
+    by_level = {}
+    for session in results:
+        for result in session:
+            by_level.setdefault(result.level, []).append(result)
+    summaries = []
+    for level, level_results in sorted(by_level.items()):
+        completed = [result for result in level_results if result.completed]
+        times = sorted(result.time for result in completed)
+        total_frames = sum(result.frames for result in level_results)
+        summaries.append(LevelSummary(
+            level=level,
+            sessions=len(level_results),
+            completed=len(completed),
+            score_p50=main.percentile(sorted(result.score for result in level_results), 50),
+            time_p50=main.percentile(times, 50) if times else None,
+            time_p95=main.percentile(times, 95) if times else None,
+            frame_mean=sum(result.frame_cost.total for result in level_results) / total_frames,
+            session_p99_p95=main.percentile(sorted(result.frame_cost.p99 for result in level_results), 95),
+        ))
+    return summaries
+
+
+def report_lines(summaries):
+    lines = ['{:>5} {:>8} {:>9} {:>9} {:>9} {:>9} {:>10} {:>15}'.format(
+        'Level', 'Sessions', 'Completed', 'Score p50', 'Time p50', 'Time p95', 'Frame mean', 'Session p99 p95')]
+    for summary in summaries:
+        times = ['{:8.1f}s'.format(time) if time is not None else '{:>9}'.format('-')
+                 for time in (summary.time_p50, summary.time_p95)]
+        lines.append('{:>5} {:>8} {:>9} {:>9,} {} {} {:8.3f}ms {:13.3f}ms'.format(
+            summary.level, summary.sessions, summary.completed, summary.score_p50, times[0], times[1],
+            summary.frame_mean * 1000, summary.session_p99_p95 * 1000))
+    return lines
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Batch simulate AstroSky games with a bot player')
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--levels', type=int, default=4,
+                        help='Stop each session after this many levels')
+    parser.add_argument('--max-time', type=float, default=900,
+                        help='Stop each session after this many simulated seconds')
+    parser.add_argument('--dt', type=float, default=1. / main.FPS,
+                        help='Simulation step, in seconds')
+    parser.add_argument('--skill', type=float, default=1.0,
+                        help="Chance the bot acts on any given frame, from 0 to 1")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the first session; later sessions count up from it')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes (default: one per core)')
+    parser.add_argument('--json', default=None, metavar='PATH',
+                        help='Also write the per-level summary to PATH as JSON')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    start = perf_counter()
+    results = run_sessions(args.sessions, seed=args.seed, processes=args.processes, levels=args.levels,
+                           max_time=args.max_time, dt=args.dt, skill=args.skill)
+    elapsed = perf_counter() - start
+    summaries = summarize(results)
+    print('{} sessions in {:.1f}s ({:,.0f} per minute)'.format(
+        args.sessions, elapsed, args.sessions / elapsed * 60))
+    print('\n'.join(report_lines(summaries)))
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump([summary._asdict() for summary in summaries], json_file, indent=2)